@@ -4,6 +4,7 @@ import matplotlib.pyplot
 import numpy
 import config
 import multiplier_matcher
+import poa_cost
 import pvlib_poa
 import splitters
 
@@ -15,7 +16,7 @@ import splitters
 ############################
 
 
-def test_single_pair_of_angles(day_xa, known_latitude, known_longitude, tilt, facing):
+def test_single_pair_of_angles(day_xa, known_latitude, known_longitude, tilt, facing, sky=None):
     """
     Tests a pair of angles against a day of measurements. Returns a fitness value, lower is better
     :param day_xa: xarrya containing one day of measurements
@@ -23,6 +24,8 @@ def test_single_pair_of_angles(day_xa, known_latitude, known_longitude, tilt, fa
     :param known_longitude: longitude coodrinate of installation in wgs84
     :param tilt: test tilt angle
     :param facing: test facing angle
+    :param sky: optional pvlib_poa.get_sky_for_day result for the same day and location, saves recomputing solar
+    positions when many angles are tested
     :return: fitness value, lower is better
     """
 
@@ -31,7 +34,10 @@ def test_single_pair_of_angles(day_xa, known_latitude, known_longitude, tilt, fa
     year_n = day_xa.year.values[0]
 
     # creating initial poa
-    poa_initial = pvlib_poa.get_irradiance(year_n, known_latitude, known_longitude, day_n, tilt, facing)
+    if sky is None:
+        poa_initial = pvlib_poa.get_irradiance(year_n, known_latitude, known_longitude, day_n, tilt, facing)
+    else:
+        poa_initial = pvlib_poa.get_irradiance_from_sky(sky, tilt, facing)
 
     # matching poa with single segment integral method
     multiplier = find_best_multiplier_for_poa_to_match_single_day_using_integral(day_xa, poa_initial)
@@ -45,6 +51,235 @@ def test_single_pair_of_angles(day_xa, known_latitude, known_longitude, tilt, fa
     return fitness
 
 
+def test_angles_against_day(day_xa, known_latitude, known_longitude, tilts, facings, sky=None, chunk_size=None,
+                            surrogate=False):
+    """
+    Batched version of test_single_pair_of_angles. Measurements are prepared once, after which poa, integral
+    multiplier and l1 cost are computed for all angle pairs of a chunk as matrix operations
+    :param day_xa: xarray containing one day of measurements
+    :param known_latitude: latitude coordinate of installation in wgs84
+    :param known_longitude: longitude coodrinate of installation in wgs84
+    :param tilts: array of test tilt angles in degrees
+    :param facings: array of test facing angles in degrees
+    :param sky: optional pvlib_poa.get_sky_for_day result for the same day and location
+    :param chunk_size: angle pairs evaluated at a time, config.POA_MATRIX_CHUNK_ANGLES if None. Bounds memory use
+    :param surrogate: if True, poa comes from pvlib_poa.get_irradiance_from_basis which is several times faster
+    :return: numpy array of fitness values, same as test_single_pair_of_angles would return for each pair. Pairs for
+    which simulated poa is zero over the measured minutes get inf
+    """
+    tilts = numpy.atleast_1d(numpy.asarray(tilts, dtype=float))
+    facings = numpy.atleast_1d(numpy.asarray(facings, dtype=float))
+    if chunk_size is None:
+        chunk_size = config.POA_MATRIX_CHUNK_ANGLES
+
+    if sky is None:
+        sky = pvlib_poa.get_sky_for_day(day_xa.year.values[0], known_latitude, known_longitude, day_xa.day.values[0])
+
+    first_minute, last_minute, measured_sum, cost_minutes, cost_powers = __prepare_measurement_day(day_xa)
+
+    # only minutes between first and last measured minute affect multipliers and costs
+    window_sky = sky.iloc[first_minute:last_minute + 1]
+    cost_minutes = cost_minutes - first_minute
+
+    if surrogate:
+        basis = pvlib_poa.get_poa_basis(window_sky)
+
+    fitnesses = numpy.empty(len(tilts))
+
+    for start in range(0, len(tilts), chunk_size):
+        if surrogate:
+            poa = pvlib_poa.get_irradiance_from_basis(basis, tilts[start:start + chunk_size],
+                                                      facings[start:start + chunk_size])
+        else:
+            poa = pvlib_poa.get_irradiance_matrix(window_sky, tilts[start:start + chunk_size],
+                                                  facings[start:start + chunk_size])
+
+        # integral multipliers, as in find_best_multiplier_for_poa_to_match_single_day_using_integral
+        poa_sums = poa.sum(axis=1)
+        matchable = poa_sums > 0
+        multipliers = numpy.where(matchable, measured_sum / numpy.where(matchable, poa_sums, 1), 0)
+
+        deltas, percents, costs = poa_cost.get_measurement_to_poa_cost(cost_minutes, cost_powers,
+                                                                       poa * multipliers[:, numpy.newaxis])
+        fitnesses[start:start + chunk_size] = numpy.where(matchable, costs, math.inf)
+
+    return fitnesses
+
+
+def find_best_angles_for_days(day_xas, known_latitude, known_longitude, tilts, facings, exact_candidates=None):
+    """
+    Scores angle pairs against one or more days with surrogate poa, then scores the best candidates again with exact
+    pvlib poa. Fitness of a pair is the sum of its fitnesses over the days
+    :param day_xas: list of xarrays, each containing one day of measurements
+    :param known_latitude: latitude coordinate of installation in wgs84
+    :param known_longitude: longitude coodrinate of installation in wgs84
+    :param tilts: array of test tilt angles in degrees
+    :param facings: array of test facing angles in degrees
+    :param exact_candidates: amount of pairs scored again, config.SURROGATE_EXACT_CANDIDATES if None
+    :return: best_tilt, best_facing, best_fitness. Angles in degrees, fitness from exact poa
+    """
+    tilts = numpy.atleast_1d(numpy.asarray(tilts, dtype=float))
+    facings = numpy.atleast_1d(numpy.asarray(facings, dtype=float))
+    if exact_candidates is None:
+        exact_candidates = config.SURROGATE_EXACT_CANDIDATES
+
+    surrogate_fitnesses = __get_fitnesses_for_days(day_xas, known_latitude, known_longitude, tilts, facings, True)
+
+    # candidates in order of surrogate fitness
+    candidates = numpy.argsort(surrogate_fitnesses)[:exact_candidates]
+
+    exact_fitnesses = __get_exact_fitnesses_for_days(day_xas, known_latitude, known_longitude, tilts[candidates],
+                                                     facings[candidates])
+
+    best = candidates[numpy.argmin(exact_fitnesses)]
+    print("best of " + str(len(candidates)) + " surrogate candidates: tilt " + str(round(tilts[best], 2)) + " facing "
+          + str(round(facings[best], 2)) + " fitness " + str(round(numpy.min(exact_fitnesses), 2)))
+
+    return tilts[best], facings[best], numpy.min(exact_fitnesses)
+
+
+def adaptive_angle_search(day_xas, known_latitude, known_longitude, coarse_samples=None, basins=None,
+                          refine_samples=None, resolution=None, surrogate=True):
+    """
+    Coarse to fine search for panel angles. A coarse global fibonacci lattice is evaluated first, after which the best
+    points which are not neighbours of each other are refined with denser local lattices around them until point
+    spacing is below resolution. Fitness of an angle pair is the sum of its fitnesses over the days
+    :param day_xas: list of xarrays, each containing one day of measurements
+    :param known_latitude: latitude coordinate of installation in wgs84
+    :param known_longitude: longitude coodrinate of installation in wgs84
+    :param coarse_samples: size of the global lattice, config.ADAPTIVE_SEARCH_COARSE_SAMPLES if None
+    :param basins: amount of refined points, config.ADAPTIVE_SEARCH_BASINS if None
+    :param refine_samples: local lattice size per basin and level, config.ADAPTIVE_SEARCH_REFINE_SAMPLES if None
+    :param resolution: target point spacing in degrees, config.ADAPTIVE_SEARCH_RESOLUTION_DEGREES if None
+    :param surrogate: if True, lattices are scored with surrogate poa and final basins again with exact poa
+    :return: best_tilt, best_azimuth, best_fitness, evaluations. Angles in degrees, evaluations is the amount of
+    scored angle pairs
+    """
+    if coarse_samples is None:
+        coarse_samples = config.ADAPTIVE_SEARCH_COARSE_SAMPLES
+    if basins is None:
+        basins = config.ADAPTIVE_SEARCH_BASINS
+    if refine_samples is None:
+        refine_samples = config.ADAPTIVE_SEARCH_REFINE_SAMPLES
+    if resolution is None:
+        resolution = config.ADAPTIVE_SEARCH_RESOLUTION_DEGREES
+
+    # coarse global lattice, points are spread over a half sphere of 2 pi steradians
+    tilts_rad, azimuths_rad = get_fibonacci_distribution_tilts_azimuths(coarse_samples)
+    tilts = numpy.degrees(tilts_rad)
+    azimuths = numpy.degrees(azimuths_rad)
+    spacing = numpy.degrees(math.sqrt(2 * math.pi / len(tilts)))
+
+    fitnesses = __get_fitnesses_for_days(day_xas, known_latitude, known_longitude, tilts, azimuths, surrogate)
+    evaluations = len(tilts)
+
+    # best points which are further than two lattice spacings from better points, each one is a separate basin
+    basin_tilts, basin_azimuths, basin_fitnesses = __get_separated_best_points(tilts, azimuths, fitnesses, basins,
+                                                                               2 * spacing)
+
+    print("coarse lattice of " + str(evaluations) + " points, spacing " + str(round(spacing, 2)) + " degrees")
+
+    # each level covers two spacings of the previous level around each basin with a denser lattice
+    while spacing > resolution:
+        radius = 2 * spacing
+        spacing = numpy.degrees(math.sqrt(2 * math.pi * (1 - math.cos(math.radians(radius))) / refine_samples))
+
+        for b in range(len(basin_tilts)):
+            tilts, azimuths = get_fibonacci_cap_tilts_azimuths(basin_tilts[b], basin_azimuths[b], radius,
+                                                               refine_samples)
+            fitnesses = __get_fitnesses_for_days(day_xas, known_latitude, known_longitude, tilts, azimuths, surrogate)
+            evaluations += len(tilts)
+
+            best = numpy.argmin(fitnesses)
+            if fitnesses[best] < basin_fitnesses[b]:
+                basin_tilts[b], basin_azimuths[b], basin_fitnesses[b] = tilts[best], azimuths[best], fitnesses[best]
+
+        print("refined " + str(len(basin_tilts)) + " basins to spacing " + str(round(spacing, 3)) + " degrees, "
+              + str(evaluations) + " evaluations")
+
+    if surrogate:
+        basin_fitnesses = __get_exact_fitnesses_for_days(day_xas, known_latitude, known_longitude, basin_tilts,
+                                                         basin_azimuths)
+        evaluations += len(basin_tilts)
+
+    best = numpy.argmin(basin_fitnesses)
+    print("adaptive search best: tilt " + str(round(basin_tilts[best], 2)) + " azimuth "
+          + str(round(basin_azimuths[best], 2)) + " after " + str(evaluations) + " evaluations")
+
+    return basin_tilts[best], basin_azimuths[best], basin_fitnesses[best], evaluations
+
+
+def optimize_angles_for_days(day_xas, known_latitude, known_longitude, seed_samples=None, starts=None,
+                             tolerance=None, max_evaluations=None):
+    """
+    Continuous search for panel angles. Good points of a small global fibonacci lattice are used as starts for
+    Nelder-Mead simplex searches of the test_single_pair_of_angles fitness. Simplexes move in azimuthal equidistant
+    coordinates around the zenith, tilt*cos(azimuth) and tilt*sin(azimuth), which have no discontinuity at tilt 0 or
+    azimuth 360 and where distances are close to angle space distances
+    :param day_xas: list of xarrays, each containing one day of measurements. Fitnesses are summed over the days
+    :param known_latitude: latitude coordinate of installation in wgs84
+    :param known_longitude: longitude coodrinate of installation in wgs84
+    :param seed_samples: size of the seed lattice, config.OPTIMIZER_SEED_SAMPLES if None
+    :param starts: amount of simplex searches, config.OPTIMIZER_STARTS if None
+    :param tolerance: simplex size in degrees at which searches stop, config.OPTIMIZER_TOLERANCE_DEGREES if None
+    :param max_evaluations: evaluation budget shared by the seed lattice and all searches,
+    config.OPTIMIZER_MAX_EVALUATIONS if None
+    :return: best_tilt, best_azimuth, best_fitness, evaluations. Angles in degrees, evaluations is the amount of
+    scored angle pairs
+    """
+    if seed_samples is None:
+        seed_samples = config.OPTIMIZER_SEED_SAMPLES
+    if starts is None:
+        starts = config.OPTIMIZER_STARTS
+    if tolerance is None:
+        tolerance = config.OPTIMIZER_TOLERANCE_DEGREES
+    if max_evaluations is None:
+        max_evaluations = config.OPTIMIZER_MAX_EVALUATIONS
+
+    # seed lattice, scored with exact poa
+    tilts_rad, azimuths_rad = get_fibonacci_distribution_tilts_azimuths(seed_samples)
+    tilts = numpy.degrees(tilts_rad)
+    azimuths = numpy.degrees(azimuths_rad)
+    spacing = numpy.degrees(math.sqrt(2 * math.pi / len(tilts)))
+
+    fitnesses = __get_fitnesses_for_days(day_xas, known_latitude, known_longitude, tilts, azimuths, False)
+    evaluations = len(tilts)
+
+    seed_tilts, seed_azimuths, seed_fitnesses = __get_separated_best_points(tilts, azimuths, fitnesses, starts,
+                                                                            2 * spacing)
+
+    def fitness_at(point):
+        tilt, azimuth = __plane_to_angles(point)
+        return __get_exact_fitnesses_for_days(day_xas, known_latitude, known_longitude, [tilt], [azimuth])[0]
+
+    best_point, best_fitness = None, math.inf
+    for i in range(len(seed_tilts)):
+        # remaining budget is split evenly between remaining searches
+        budget = (max_evaluations - evaluations) // (len(seed_tilts) - i)
+        if budget < 3:
+            break
+
+        point, fitness, used = __nelder_mead(fitness_at, __angles_to_plane(seed_tilts[i], seed_azimuths[i]),
+                                             spacing / 2, tolerance, budget)
+        evaluations += used
+
+        print("simplex search from tilt " + str(round(seed_tilts[i], 2)) + " azimuth " + str(round(seed_azimuths[i], 2))
+              + " ended at fitness " + str(round(fitness, 2)) + " after " + str(used) + " evaluations")
+
+        if fitness < best_fitness:
+            best_point, best_fitness = point, fitness
+
+    # budget was too small for any search, falling back to the best lattice point
+    if best_point is None:
+        best_point, best_fitness = __angles_to_plane(seed_tilts[0], seed_azimuths[0]), seed_fitnesses[0]
+
+    best_tilt, best_azimuth = __plane_to_angles(best_point)
+    print("optimizer best: tilt " + str(round(best_tilt, 2)) + " azimuth " + str(round(best_azimuth, 2)) + " after "
+          + str(evaluations) + " evaluations")
+
+    return best_tilt, best_azimuth, best_fitness, evaluations
+
+
 def take_poa_and_return_multiplied_poa_best_matching_measurements(xa_day, poa):
     """
     Takes measurements and simulation, returns simulation scaled to match measurements
@@ -57,26 +292,18 @@ def take_poa_and_return_multiplied_poa_best_matching_measurements(xa_day, poa):
     return poa
 
 
-def get_measurement_to_poa_delta_cost(xa_day, poa):
+def get_measurement_to_poa_delta_cost(xa_day, poa, norm="l1"):
     """
     Returns the delta between measurements and simualted values
     :param xa_day:
     :param poa:
+    :param norm: "l1", "l2", "relative" or a function, see poa_cost
     :return:
     """
 
     deltas, percents, minutes = __get_measurement_to_poa_delta(xa_day, poa)
 
-    # print(percents)
-
-    #percentual_cost = sum([abs(ele) for ele in percents]) / len(percents)
-
-    #print(poa)
-    #print(xa_day)
-
-    abs_deltas = sum([abs(ele) for ele in deltas])
-
-    return  abs_deltas #/len(deltas)
+    return poa_cost.get_cost(deltas, percents, norm)
 
 
 
@@ -94,7 +321,8 @@ def find_best_multiplier_for_poa_to_match_single_day_using_integral(day_xa, poa)
     # getting area under measurements and the minutes that were used
     xa_minutes = xa2["minute"].values
     xa_powers = xa2["power"].values[0][0]
-    sum_of_measured_powers = sum(xa_powers)
+    # summing in float64, float32 measurements would otherwise accumulate rounding errors
+    sum_of_measured_powers = numpy.sum(xa_powers, dtype=numpy.float64)
 
     # assuming that there are no gaps in the data
     first_minute = xa_minutes[0]
@@ -120,7 +348,9 @@ def get_multiplier_matched_poa(day_xa, latitude, longitude, tilt, azimuth):
     year_n = day_xa.year.values[0]
     poa = pvlib_poa.get_irradiance(year_n, latitude, longitude, day_n, tilt, azimuth)
     multiplier = multiplier_matcher.get_estimated_multiplier_for_day(day_xa, poa)
-    poa = pvlib_poa.get_irradiance_with_multiplier(year_n, latitude, longitude, day_n, tilt, azimuth, multiplier)
+
+    # scaling the already simulated poa, same result as get_irradiance_with_multiplier without simulating again
+    poa["POA"] = poa["POA"] * multiplier
 
     return poa
 
@@ -146,25 +376,14 @@ def test_n_fibonacchi_sample_fitnesses_against_day(day_xa, samples, latitude, lo
     print("estimating grid density, assuming points are spread evenly there should be a point every " + str(round(delta,4)) + " degrees")
 
     # tilt and azimuth values in degrees
-    tilts_deg, azimuths_deg = [], []
-    for i in range(len(tilts_rad)):
-        tilts_deg.append((tilts_rad[i] / (2 * math.pi)) * 360)
-        azimuths_deg.append((azimuths_rad[i] / (2 * math.pi)) * 360)
-
-    # debugging messages
-    #print("testing fitnessess at tilts:")
-    #print(tilts_deg)
-    #print("and azimuths")
-    #print(azimuths_deg)
-
-    # creating poa at tilt+azimuth and fitness
-    fitnesses = []
-
-    for i in range(len(tilts_deg)):
-        tilt = tilts_deg[i]
-        azimuth = azimuths_deg[i]
-        fitness = test_single_pair_of_angles(day_xa, latitude, longitude, tilt, azimuth)
-        fitnesses.append(fitness)
+    tilts_deg = numpy.degrees(tilts_rad)
+    azimuths_deg = numpy.degrees(azimuths_rad)
+
+    # solar positions and clear sky irradiance are the same for every angle pair, computing them once
+    sky = pvlib_poa.get_sky_for_day(year_n, latitude, longitude, day_n)
+
+    # creating poa at tilt+azimuth and fitness for every pair at once
+    fitnesses = test_angles_against_day(day_xa, latitude, longitude, tilts_deg, azimuths_deg, sky)
 
     return tilts_rad, azimuths_rad, fitnesses
 
@@ -199,15 +418,15 @@ def get_best_fitness_out_of_results(tilt_rads, azimuth_rads, fitnesses):
 
 
 
-def get_fibonacci_distribution_tilts_azimuths_near_coordinate(tilt, azimuth, samples_total, distance):
+def get_fibonacci_distribution_tilts_azimuths_near_coordinate(tilt, azimuth, samples_total, distance, plot=False):
     """
-    Unused function, generates local lattices
     Returns fibonacci lattice points which are closer than (distance) from (tilt) and (azimuth) in cartesian space
     :param tilt: Tilt angle in degrees
     :param azimuth: Azimuth angle in degrees
     :param samples_total: Samples in the complete fibonacci lattice, amount of returned points will be lower
     :param distance: max distance from tilt/azimuth
-    :return: [tilts], [azimuths]
+    :param plot: if True, the returned points are shown in a 3d plot
+    :return: [tilts], [azimuths] in radians
     """
 
     tilt_rad = numpy.radians(tilt)
@@ -218,64 +437,50 @@ def get_fibonacci_distribution_tilts_azimuths_near_coordinate(tilt, azimuth, sam
     y = math.sin(azimuth_rad) * math.sin(tilt_rad)
     z = math.cos(tilt_rad)
 
+    # xyz, tilts and azimuths of the complete half sphere lattice
+    xvals, yvals, zvals, phis, thetas = __get_fibonacci_samples(samples_total * 2)
 
-    print("xyz" + str(x) + " - " + str(y) + " " + str(z))
-
+    # points closer to tilt and azimuth than distance
+    close = numpy.sqrt((x - xvals) ** 2 + (y - yvals) ** 2 + (z - zvals) ** 2) < distance
 
-    # x y and z values for matplotlib test plotting
-    xvals, yvals, zvals = [], [], []
-
-    # actual tilt and azimuth values
-    phis, thetas = [], []
-
-    # doubling sample count as negative half of sphere is not needed
-    # this should result in
-    iterations = samples_total * 2
-    for i in range(iterations):
-
-        # using helper to get 5 values, x,y,z,phi,theta
-        values = __get_fibonacci_sample(i, iterations)
-
-        # if z is > 0, skip this loop iteration as bottom half of sphere is not needed
-        if values[2] < 0:
-            continue
-
-        # xyz of fibonacci lattice points
-        x_f = values[0]
-        y_f = values[1]
-        z_f = values[2]
-        x_delta = x - x_f
-        y_delta = y - y_f
-        z_delta = z - z_f
-
-        fibo_distance = math.sqrt(x_delta**2 + y_delta**2 + z_delta**2)
-
-        print("fibonacci point distance: "  + str(fibo_distance))
-
-        if fibo_distance < distance:
-            # point was closer to tilt and azimuth than distance, can be added to outputs
-            # add values to lists
-            xvals.append(values[0])
-            yvals.append(values[1])
-            zvals.append(values[2])
-            phis.append(values[3])
-            thetas.append(values[4])
-
-    print(xvals)
-    print(yvals)
-    print(zvals)
-    # test plotting
-    fig = matplotlib.pyplot.figure()
-    ax = fig.add_subplot(projection='3d')
-    ax.scatter3D(xvals, yvals, zvals)
-    matplotlib.pyplot.show()
+    if plot:
+        fig = matplotlib.pyplot.figure()
+        ax = fig.add_subplot(projection='3d')
+        ax.scatter3D(xvals[close], yvals[close], zvals[close])
+        matplotlib.pyplot.show()
 
     # returning tilt and azimuth values
-    return phis, thetas
+    return phis[close], thetas[close]
 
 
+def get_fibonacci_cap_tilts_azimuths(tilt, azimuth, radius, samples):
+    """
+    Returns a local fibonacci lattice which covers a circle around tilt and azimuth evenly. Unlike
+    get_fibonacci_distribution_tilts_azimuths_near_coordinate, the point count doesn't depend on circle size
+    :param tilt: Tilt angle of circle center in degrees
+    :param azimuth: Azimuth angle of circle center in degrees
+    :param radius: circle radius in degrees
+    :param samples: amount of points in the circle, points below the horizon are dropped
+    :return: tilts, azimuths. Numpy arrays in degrees
+    """
+    # lattice around the zenith, z goes evenly from 1 to the cosine of radius so that points cover equal areas
+    k = numpy.arange(samples) + 0.5
+    z = 1 - (1 - math.cos(math.radians(radius))) * k / samples
+    theta = math.pi * (1 + math.sqrt(5)) * k
+    x = numpy.sqrt(1 - z ** 2) * numpy.cos(theta)
+    y = numpy.sqrt(1 - z ** 2) * numpy.sin(theta)
+
+    # rotating zenith to tilt around y axis and then to azimuth around z axis
+    tilt_rad = math.radians(tilt)
+    azimuth_rad = math.radians(azimuth)
+    x, z = x * math.cos(tilt_rad) + z * math.sin(tilt_rad), z * math.cos(tilt_rad) - x * math.sin(tilt_rad)
+    x, y = x * math.cos(azimuth_rad) - y * math.sin(azimuth_rad), x * math.sin(azimuth_rad) + y * math.cos(azimuth_rad)
 
+    above_horizon = z >= 0
+    tilts = numpy.degrees(numpy.arccos(numpy.clip(z[above_horizon], -1, 1)))
+    azimuths = numpy.degrees(numpy.arctan2(y[above_horizon], x[above_horizon])) % 360
 
+    return tilts, azimuths
 
 
 def get_fibonacci_distribution_tilts_azimuths(samples):
@@ -324,6 +529,165 @@ def get_fibonacci_distribution_tilts_azimuths(samples):
 #   HELPERS BELOW, CALL ONLY FROM WITHIN THIS FILE
 ############################
 
+def __get_fitnesses_for_days(day_xas, known_latitude, known_longitude, tilts, facings, surrogate):
+    """
+    :return: numpy array of fitnesses from test_angles_against_day summed over days
+    """
+    fitnesses = numpy.zeros(len(tilts))
+    for day_xa in day_xas:
+        fitnesses += test_angles_against_day(day_xa, known_latitude, known_longitude, tilts, facings,
+                                             surrogate=surrogate)
+
+    return fitnesses
+
+
+def __get_exact_fitnesses_for_days(day_xas, known_latitude, known_longitude, tilts, facings):
+    """
+    :return: numpy array of fitnesses from test_single_pair_of_angles summed over days, for scoring final candidates
+    """
+    fitnesses = numpy.zeros(len(tilts))
+    for day_xa in day_xas:
+        sky = pvlib_poa.get_sky_for_day(day_xa.year.values[0], known_latitude, known_longitude, day_xa.day.values[0])
+        for i in range(len(tilts)):
+            fitnesses[i] += test_single_pair_of_angles(day_xa, known_latitude, known_longitude, tilts[i], facings[i],
+                                                       sky)
+
+    return fitnesses
+
+
+def __get_separated_best_points(tilts, azimuths, fitnesses, count, separation):
+    """
+    Picks the best points in order of fitness, skipping points closer than separation degrees to an already picked one
+    :return: lists of picked tilts, azimuths and fitnesses, at most count points
+    """
+    picked_tilts, picked_azimuths, picked_fitnesses = [], [], []
+    for i in numpy.argsort(fitnesses):
+        if len(picked_tilts) == count:
+            break
+        if len(picked_tilts) == 0 or numpy.min(__get_angle_distances(tilts[i], azimuths[i], picked_tilts,
+                                                                     picked_azimuths)) > separation:
+            picked_tilts.append(tilts[i])
+            picked_azimuths.append(azimuths[i])
+            picked_fitnesses.append(fitnesses[i])
+
+    return picked_tilts, picked_azimuths, picked_fitnesses
+
+
+def __angles_to_plane(tilt, azimuth):
+    """
+    :return: numpy array of azimuthal equidistant coordinates in degrees, tilt*cos(azimuth), tilt*sin(azimuth)
+    """
+    return numpy.array([tilt * math.cos(math.radians(azimuth)), tilt * math.sin(math.radians(azimuth))])
+
+
+def __plane_to_angles(point):
+    """
+    :return: tilt, azimuth in degrees. Points further than 90 degrees from the zenith are moved to the horizon
+    """
+    tilt = min(math.hypot(point[0], point[1]), 90)
+    azimuth = math.degrees(math.atan2(point[1], point[0])) % 360
+
+    return tilt, azimuth
+
+
+def __nelder_mead(function, start, step, tolerance, max_evaluations):
+    """
+    Nelder-Mead simplex minimization in 2 dimensions with standard coefficients
+    :param function: function of a numpy array of 2 values, returns a float
+    :param start: numpy array, first simplex point
+    :param step: distance of the other initial simplex points from start
+    :param tolerance: search stops when all simplex points are closer than this to the best point
+    :param max_evaluations: search stops before function is called more times than this
+    :return: best point, best value, amount of function calls
+    """
+    points = [start, start + [step, 0], start + [0, step]]
+    values = [function(point) for point in points]
+    evaluations = 3
+
+    while evaluations < max_evaluations:
+        order = numpy.argsort(values)
+        points = [points[i] for i in order]
+        values = [values[i] for i in order]
+
+        if max(numpy.linalg.norm(point - points[0]) for point in points[1:]) < tolerance:
+            break
+
+        centroid = (points[0] + points[1]) / 2
+
+        # reflecting the worst point through the centroid of the others
+        reflected = centroid + (centroid - points[2])
+        reflected_value = function(reflected)
+        evaluations += 1
+
+        if reflected_value < values[0] and evaluations < max_evaluations:
+            # reflection is the new best, trying to go further in the same direction
+            expanded = centroid + 2 * (centroid - points[2])
+            expanded_value = function(expanded)
+            evaluations += 1
+            if expanded_value < reflected_value:
+                points[2], values[2] = expanded, expanded_value
+            else:
+                points[2], values[2] = reflected, reflected_value
+        elif reflected_value < values[1]:
+            points[2], values[2] = reflected, reflected_value
+        elif evaluations < max_evaluations:
+            # contracting towards the better one of the worst and the reflected point
+            if reflected_value < values[2]:
+                contracted = centroid + 0.5 * (reflected - centroid)
+            else:
+                contracted = centroid + 0.5 * (points[2] - centroid)
+            contracted_value = function(contracted)
+            evaluations += 1
+
+            if contracted_value < min(reflected_value, values[2]):
+                points[2], values[2] = contracted, contracted_value
+            elif evaluations + 2 <= max_evaluations:
+                # shrinking every point towards the best point
+                for i in [1, 2]:
+                    points[i] = points[0] + 0.5 * (points[i] - points[0])
+                    values[i] = function(points[i])
+                evaluations += 2
+            else:
+                break
+
+    best = int(numpy.argmin(values))
+
+    return points[best], values[best], evaluations
+
+
+def __get_angle_distances(tilt, azimuth, tilts, azimuths):
+    """
+    Vectorized angle_distance_between_points from one point to many, all angles in degrees
+    :return: numpy array of sphere center angles in degrees
+    """
+    tilt, azimuth = numpy.radians(tilt), numpy.radians(azimuth)
+    tilts = numpy.radians(numpy.asarray(tilts, dtype=float))
+    azimuths = numpy.radians(numpy.asarray(azimuths, dtype=float))
+
+    cosines = numpy.sin(tilt) * numpy.sin(tilts) * numpy.cos(azimuth - azimuths) + numpy.cos(tilt) * numpy.cos(tilts)
+
+    return numpy.degrees(numpy.arccos(numpy.clip(cosines, -1, 1)))
+
+
+def __get_fibonacci_samples(sample_max):
+    """
+    Vectorized __get_fibonacci_sample for every sample of the upper half of the sphere
+    :return: x, y, z, tilt(rad) and azimuth(rad) numpy arrays
+    """
+    k = numpy.arange(sample_max) + 0.5
+
+    phi = numpy.arccos(1 - 2 * k / sample_max)
+    theta = (math.pi * (1 + math.sqrt(5)) * k) % (math.pi * 2)
+
+    x = numpy.cos(theta) * numpy.sin(phi)
+    y = numpy.sin(theta) * numpy.sin(phi)
+    z = numpy.cos(phi)
+
+    upper = z >= 0
+
+    return x[upper], y[upper], z[upper], phi[upper], theta[upper]
+
+
 def __get_fibonacci_sample(sample, sample_max):
     """
     :param sample: sample number when there are sample_max samples
@@ -387,50 +751,30 @@ def angle_distance_between_points(tilt1, azimuth1, tilt2, azimuth2):
 
 
 
-def __get_measurement_to_poa_delta(xa_day, poa):
+def __prepare_measurement_day(day_xa):
     """
-    Returns a list of deltas and percentual deltas which can be used for analytics
-    :param xa_day: one day of measurements in xarray format
-    :param poa: one day of measurements in numpy dataframe
-    :return: list of deltas and list of percentual deltas
+    Reads the values test_angles_against_day needs from a measurement day, measurements are assumed to have no gaps
+    :return: first measured minute, last measured minute, sum of measured powers, minutes and powers used for costs
     """
-    # removing the lowest values and nans
-    xa_day = xa_day.where(xa_day.power >= 2)
-    xa_day = xa_day.dropna(dim="minute")
-
-    # loading poa minutes and powers
-    poa_powers = poa["POA"].values
-    poa_minutes = poa["minute"].values
+    xa_minutes, xa_powers = poa_cost.get_day_arrays(day_xa, min_power=-math.inf)
+    cost_minutes, cost_powers = poa_cost.get_day_arrays(day_xa)
 
-    # loading xa minutes and powers
-    xa_minutes = xa_day.minute.values
-    xa_powers = xa_day.power.values[0][0]
+    return int(xa_minutes[0]), int(xa_minutes[-1]), xa_powers.sum(), cost_minutes, cost_powers
 
-    deltas = []  # absolute value of deltas
-    percent_deltas = []  # percentual values of deltas, used for normalizing the errors as 5% at peak is supposed to
-    # weight as much as 5% at bottom
-    minutes = []  # contains minutes for which deltas were calculated for
 
-    #print("computing delta between measurements and poa simulation")
-    #print(xa_day)
-    #print(poa)
-
-    # TODO this loop here is likely to be the main cause for angle estimation being slow
-    # Replace with vectorized operations?
-    for i in range(len(xa_minutes)):
-        xa_minute = xa_minutes[i]  # this is poa index
-        xa_power = xa_powers[i]
-        poa_power = poa_powers[xa_minute]
-
-        delta = xa_power - poa_power
+def __get_measurement_to_poa_delta(xa_day, poa):
+    """
+    Returns deltas and percentual deltas which can be used for analytics
+    :param xa_day: one day of measurements in xarray format
+    :param poa: one day of measurements in numpy dataframe
+    :return: array of deltas, array of percentual deltas and array of minutes. Percentual deltas are nan where poa is
+    too low for them
+    """
+    # removing the lowest values and nans, minutes are poa indexes
+    minutes, powers = poa_cost.get_day_arrays(xa_day)
 
-        # poa power may be 0, avoiding zero divisions here
-        if poa_power > 1:
-            percent_delta = (delta / poa_power) * 100
-        else:
-            percent_delta = None
-        deltas.append(delta)
-        percent_deltas.append(percent_delta)
-        minutes.append(xa_minute)
+    # percentual values of deltas are used for normalizing the errors as 5% at peak is supposed to weight as much as
+    # 5% at bottom
+    deltas, percent_deltas = poa_cost.get_deltas(minutes, powers, poa["POA"].values)
 
     return deltas, percent_deltas, minutes
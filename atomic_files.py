@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+
+############################
+#   FUNCTIONS FOR WRITING FILES ATOMICALLY
+#   FILES ARE WRITTEN TO A UNIQUELY NAMED TEMPORARY FILE IN THE SAME DIRECTORY AND THEN RENAMED OVER THE TARGET, SO
+#   READERS SEE EITHER THE OLD OR THE NEW FILE. INTERRUPTED WRITES CAN'T LEAVE BROKEN FILES BEHIND AND PARALLEL
+#   PROCESSES WRITING THE SAME FILE DON'T WRITE INTO EACH OTHER'S TEMPORARY FILES
+#   TEMPORARY FILES ARE NAMED <target file name>.<random>.tmp<target extension>
+############################
+
+TEMPORARY_FILE_MARKER = ".tmp"
+
+
+def write_atomically(path, write_function):
+    """
+    :param path: target file path
+    :param write_function: function which takes a file path and writes the file there. The temporary path has the
+    same extension as path, so for example numpy.savez doesn't add another .npz
+    :return: None
+    """
+    directory, filename = os.path.split(path)
+    extension = os.path.splitext(filename)[1]
+
+    file_descriptor, temporary_path = tempfile.mkstemp(suffix=TEMPORARY_FILE_MARKER + extension, prefix=filename + ".",
+                                                       dir=directory or ".")
+    os.close(file_descriptor)
+
+    try:
+        write_function(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def is_temporary_file(filename):
+    """
+    :return: True if filename is a temporary file of write_atomically, for example one left behind by a killed process
+    """
+    return TEMPORARY_FILE_MARKER + os.path.splitext(filename)[1] in filename
@@ -4,36 +4,42 @@ import random
 import matplotlib.pyplot
 import numpy
 
+import day_quality
+import poa_cost
 import splitters
 
 matplotlib.rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
 matplotlib.rc('text', usetex=True)
 
 
-def find_smooth_days_xa(year_xa, day_start, day_end, threshold_percent):
+def find_smooth_days_xa(year_xa, day_start, day_end, threshold_percent, quality_index=None):
     """
     :param year_xa: xarray containing max one year of data
     :param day_start: first day to consider
     :param day_end: last day to consider
     :param threshold_percent: describes the normalized error accepted between a polynomial and real measurements. Use 1
+    :param quality_index: optional quality index from solar_power_data_loader.get_quality_index, days with too few
+    measurements are then skipped without slicing them from year_xa
     :return: list of xarray days which satisfy the requirements
     """
 
     #print(year_xa)
-    results = __find_smooth_days(year_xa, day_start, day_end, threshold_percent)
+    results = __find_smooth_days(year_xa, day_start, day_end, threshold_percent, quality_index)
     return results[0]
 
 
-def find_smooth_days_numbers(year_xa, day_start, day_end, threshold_percent):
+def find_smooth_days_numbers(year_xa, day_start, day_end, threshold_percent, quality_index=None):
     """
     :param year_xa: xarray containing max one year of data
     :param day_start: first day to consider
     :param day_end: last day to consider
     :param threshold_percent: describes the normalized error accepted between a polynomial and real measurements. Use 1
+    :param quality_index: optional quality index from solar_power_data_loader.get_quality_index, days with too few
+    measurements are then skipped without slicing them from year_xa
     :return: list of xarray days which satisfy the requirements
     """
     #print(year_xa)
-    results = __find_smooth_days(year_xa, day_start, day_end, threshold_percent)
+    results = __find_smooth_days(year_xa, day_start, day_end, threshold_percent, quality_index)
     return results[1]
 
 
@@ -117,13 +123,14 @@ def cloud_free_day_finder_visual(year_xa, day_start, day_end, threshold_percent)
 
 
 
-def __find_smooth_days(year_xa, day_start, day_end, threshold_percent):
+def __find_smooth_days(year_xa, day_start, day_end, threshold_percent, quality_index=None):
     """
     INTERNAL METHOD
     :param year_xa: xarray of one year
     :param day_start: first day to consider
     :param day_end: last day to consider
     :param threshold_percent: smoothness percent, very best days for helsinki dataset are less than 0.4%, 1 gives a good amount of results
+    :param quality_index: optional quality index, days which __day_smoothness_value would rate as infinity are skipped
     :return: list of xa days and a list of day numbers
     """
 
@@ -139,15 +146,19 @@ def __find_smooth_days(year_xa, day_start, day_end, threshold_percent):
     If the range contains "bad days", this could cause issues. For example a day with zero power for every minute
     This perfectly smooth, but at the same time it's the opposite of what we want
     """
-    for day_number in range(day_start, day_end):
-        day_xa = splitters.slice_xa(year_xa, year, year, day_number, day_number)
+    candidate_days = None
+    if quality_index is not None:
+        # same limits as in __day_smoothness_value, at least 10 values and some power. Other days are not read at all
+        candidate_days = day_quality.select_days(quality_index, year, day_start, day_end - 1, min_valid_minutes=10,
+                                                 min_max_power=0)
 
-        smoothness_value = __day_smoothness_value(day_xa)
+    for record in splitters.iterate_days(year_xa, year, day_start, year, day_end - 1, days=candidate_days):
+        smoothness_value = __day_smoothness_value(record.minutes, record.powers)
 
         # print("day:" + str(day_number) + " smoothness: " + str(smoothness_value))
         if smoothness_value < threshold_percent:
-            smooth_days_xa.append(day_xa)
-            smooth_days_numbers.append(day_number)
+            smooth_days_xa.append(splitters.slice_xa(year_xa, year, year, record.day, record.day))
+            smooth_days_numbers.append(record.day)
         # print("day: " + str(day_number) + " percents off from smooth approximation: " + str(smoothness_value))
 
     return smooth_days_xa, smooth_days_numbers
@@ -159,28 +170,15 @@ def __find_smooth_days(year_xa, day_start, day_end, threshold_percent):
 ############################
 
 
-def __day_smoothness_value(day_xa):
+def __day_smoothness_value(minutes, powers):
     """
     INTERNAL METHOD
-    :param day_xa: one day of real measurement data in xa format, has to have fields "minute" and "power"
+    :param minutes: minutes of one day of real measurement data, without nan values
+    :param powers: powers of the same minutes
     :return:  percent value which tells how much longer the distance from point to point is compared to sine/cosine
     fitted curve. Values lower than 1 can be considered good. Returns infinity if too few values in day
     """
 
-    # no values at all, returning infinity
-    if len(day_xa["power"].values[0]) == 0:
-        return math.inf
-
-    # print("Calculating smoothness value")
-    # print(day_xa)
-    day_xa = day_xa.dropna(dim="minute")
-
-    # day = day_xa.day.values[0]
-
-    # extracting x and y values
-    minutes = day_xa["minute"].values
-    powers = day_xa["power"].values[0][0]
-
     # too few values, returning ab
     if len(powers) < 10:
         return math.inf
@@ -230,38 +228,13 @@ def __day_smoothness_value(day_xa):
 
 def __get_measurement_to_poa_delta(xa_day, poa):
     """
-    Returns a list of deltas and percentual deltas which can be used for analytics
+    Returns deltas and percentual deltas which can be used for analytics
     :param xa_day: one day of measurements in xarray format
     :param poa: one day of measurements in numpy dataframe
-    :return: list of deltas and list of percentual deltas
+    :return: array of deltas, array of percentual deltas and array of minutes, see poa_cost.get_deltas
     """
-    # removing the lowest values and nans
-    xa_day = xa_day.where(xa_day.power >= 2)
-    xa_day = xa_day.dropna(dim="minute")
-
-    # loading poa minutes and powers
-    poa_powers = poa["POA"].values
-    poa_minutes = poa["minute"].values
-
-    # loading xa minutes and powers
-    xa_minutes = xa_day.minute.values
-    xa_powers = xa_day.power.values[0][0]
-
-    deltas = []  # absolute value of deltas
-    percent_deltas = []  # percentual values of deltas, used for normalizing the errors as 5% at peak is supposed to
-    # weight as much as 5% at bottom
-    minutes = []  # contains minutes for which deltas were calculated for
-
-    for i in range(len(xa_minutes)):
-        xa_minute = xa_minutes[i]  # this is poa index
-        xa_power = xa_powers[i]
-        poa_power = poa_powers[xa_minute]
-
-        delta = xa_power - poa_power
-        percent_delta = (delta / poa_power) * 100
-        deltas.append(delta)
-        percent_deltas.append(percent_delta)
-        minutes.append(xa_minute)
+    minutes, powers = poa_cost.get_day_arrays(xa_day)
+    deltas, percent_deltas = poa_cost.get_deltas(minutes, powers, poa["POA"].values)
 
     return deltas, percent_deltas, minutes
 
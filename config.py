@@ -31,6 +31,42 @@ DEFAULT_LONG = 28  #28
 DEFAULT_LAT = 70 #60
 
 
+############################
+#   DATA CACHE
+############################
+DATA_CACHE_DIRECTORY = "data_cache"  # loaded measurement xarrays are cached here, delete directory to clear cache
+STREAMING_CHUNK_ROWS = 1000000  # rows parsed at a time when streaming csv to a cube, ~300MB of memory per 1M rows
+LAZY_CHUNKS = {"year": 1, "day": 16}  # dask chunks for lazily loaded measurements, 16 days of float32 is ~92kB
+DAY_ITERATOR_BLOCK_DAYS = 32  # days read at a time by splitters.iterate_days
+
+
+############################
+#   POA SIMULATION CACHE
+############################
+POA_CACHE_MAX_BYTES = 64 * 1024 * 1024  # in-process cache of simulated poa days, one day takes ~35kB
+POA_CACHE_DIRECTORY = None  # set to a directory path to also store simulated poa days on disk between runs
+POA_CACHE_COORDINATE_DECIMALS = 6  # latitudes and longitudes are rounded to this many decimals before simulation
+POA_CACHE_ANGLE_DECIMALS = 6  # panel tilts and facings are rounded to this many decimals before simulation
+POA_MATRIX_CHUNK_ANGLES = 1000  # angle pairs transposed at a time by get_irradiance_matrix, bounds temporary memory
+SUN_EVENT_SOLVER_PRECISION_MINUTES = 0.001  # sunrise and sunset times are solved to this precision
+SUN_EVENT_TOLERANCE_MINUTES = 1  # accepted difference between solved and poa simulated first and last minutes
+DAYLIGHT_WINDOW_MARGIN_MINUTES = 2  # minutes simulated before first and after last daylight minute in windowed mode
+
+
+############################
+#   ANGLE ESTIMATION
+############################
+SURROGATE_EXACT_CANDIDATES = 10  # best surrogate scored angle pairs which are scored again with exact pvlib poa
+ADAPTIVE_SEARCH_COARSE_SAMPLES = 200  # global fibonacci lattice size of the first adaptive search level, ~10 degrees
+ADAPTIVE_SEARCH_BASINS = 3  # best separated lattice points which are refined by the adaptive search
+ADAPTIVE_SEARCH_REFINE_SAMPLES = 50  # points per basin on each refinement level, halves point spacing per level
+ADAPTIVE_SEARCH_RESOLUTION_DEGREES = 0.1  # adaptive search stops when point spacing is below this
+OPTIMIZER_SEED_SAMPLES = 30  # global fibonacci lattice size from which continuous optimizer starts are picked
+OPTIMIZER_STARTS = 2  # continuous optimizer runs, each starts from a separate good lattice point
+OPTIMIZER_TOLERANCE_DEGREES = 0.05  # continuous optimizer stops when all simplex points are this close to the best
+OPTIMIZER_MAX_EVALUATIONS = 150  # evaluation budget of continuous optimizer, seed lattice included
+
+
 ############################
 #   COLORS
 ############################
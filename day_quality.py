@@ -0,0 +1,148 @@
+import numpy
+import xarray
+
+import atomic_files
+
+
+############################
+#   FUNCTIONS FOR PER-DAY DATA QUALITY INDEXES
+#   A QUALITY INDEX IS AN XARRAY WITH YEAR AND DAY DIMENSIONS AND ONE DATA VARIABLE PER STATISTIC:
+#   valid_minutes, first_minute, last_minute, longest_gap, second_longest_gap, max_power
+#   GAPS ARE DIFFERENCES BETWEEN CONSECUTIVE VALID MINUTES, 1 MEANS THAT NO MINUTES ARE MISSING
+#   DAYS WITHOUT VALID MINUTES HAVE -1 AS FIRST AND LAST MINUTE, 0 AS GAPS AND NAN AS MAX POWER
+############################
+
+QUALITY_VARIABLES = ["valid_minutes", "first_minute", "last_minute", "longest_gap", "second_longest_gap", "max_power"]
+
+# statistics of a day without valid minutes, useful as reindex fill values
+EMPTY_DAY_STATISTICS = {"valid_minutes": 0, "first_minute": -1, "last_minute": -1, "longest_gap": 0,
+                        "second_longest_gap": 0, "max_power": numpy.nan}
+
+
+def compute_quality_index(xa):
+    """
+    Computes a quality index from measurements. Lazily loaded xarrays are computed one year at a time
+    :param xa: xarray with power data variable and year, day, minute coordinates
+    :return: quality index xarray with year, day coordinates
+    """
+    power = xa["power"].transpose("year", "day", "minute")
+    minute_values = power["minute"].values
+
+    yearly_statistics = []
+    for year in power["year"].values:
+        yearly_statistics.append(compute_day_statistics(power.sel(year=year).values, minute_values))
+
+    data_variables = dict()
+    for name in QUALITY_VARIABLES:
+        values = numpy.stack([statistics[name] for statistics in yearly_statistics])
+        data_variables[name] = (("year", "day"), values)
+
+    return xarray.Dataset(data_variables, coords={"year": power["year"].values, "day": power["day"].values})
+
+
+def compute_day_statistics(powers, minute_values=None):
+    """
+    Vectorized statistics for any amount of days
+    :param powers: array of shape (..., minutes), nan for missing minutes
+    :param minute_values: minute numbers of the last axis, defaults to 0, 1, 2 ...
+    :return: dict of statistic name -> array of shape (...)
+    """
+    powers = numpy.asarray(powers, dtype=float)
+    if minute_values is None:
+        minute_values = numpy.arange(powers.shape[-1])
+    minute_values = numpy.asarray(minute_values, dtype=numpy.int64)
+
+    valid = ~numpy.isnan(powers)
+    valid_minutes = valid.sum(axis=-1)
+    has_values = valid_minutes > 0
+
+    # first and last valid minute, argmax returns the first True
+    first_positions = numpy.argmax(valid, axis=-1)
+    last_positions = powers.shape[-1] - 1 - numpy.argmax(valid[..., ::-1], axis=-1)
+    first_minutes = numpy.where(has_values, minute_values[first_positions], -1)
+    last_minutes = numpy.where(has_values, minute_values[last_positions], -1)
+
+    # previous valid minute for every position, -1 before the first valid minute
+    valid_minute_values = numpy.where(valid, minute_values, -1)
+    previous_valid_minutes = numpy.maximum.accumulate(valid_minute_values, axis=-1)
+
+    # gap between every valid minute and the valid minute before it
+    gaps = numpy.zeros(powers.shape, dtype=numpy.int64)
+    has_previous = valid[..., 1:] & (previous_valid_minutes[..., :-1] >= 0)
+    gaps[..., 1:] = numpy.where(has_previous, minute_values[1:] - previous_valid_minutes[..., :-1], 0)
+
+    # two largest gaps, equal gaps count twice
+    if gaps.shape[-1] >= 2:
+        two_largest_gaps = numpy.partition(gaps, -2, axis=-1)[..., -2:]
+        longest_gaps = two_largest_gaps.max(axis=-1)
+        second_longest_gaps = two_largest_gaps.min(axis=-1)
+    else:
+        longest_gaps = gaps.max(axis=-1)
+        second_longest_gaps = numpy.zeros(longest_gaps.shape, dtype=numpy.int64)
+
+    max_powers = numpy.where(has_values, numpy.max(numpy.where(valid, powers, -numpy.inf), axis=-1), numpy.nan)
+
+    return {
+        "valid_minutes": valid_minutes,
+        "first_minute": first_minutes,
+        "last_minute": last_minutes,
+        "longest_gap": longest_gaps,
+        "second_longest_gap": second_longest_gaps,
+        "max_power": max_powers
+    }
+
+
+def select_days(quality_index, year, first_day, last_day, min_valid_minutes=None, max_valid_minutes=None,
+                max_longest_gap=None, min_max_power=None):
+    """
+    Vectorized query for days which satisfy every given limit. Limits which are None are not checked
+    :param quality_index: quality index xarray
+    :param year: year to select days from
+    :param first_day: first day to consider
+    :param last_day: last day to consider, inclusive
+    :param min_valid_minutes: days with fewer valid minutes are rejected
+    :param max_valid_minutes: days with more valid minutes are rejected
+    :param max_longest_gap: days with a longer gap are rejected
+    :param min_max_power: days with max power not above this are rejected. Use 0 to reject days with no power at all
+    :return: array of day numbers
+    """
+    if year not in quality_index["year"].values:
+        return numpy.array([], dtype=numpy.int64)
+
+    year_index = quality_index.sel(year=year)
+    days = year_index["day"].values
+
+    selected = (days >= first_day) & (days <= last_day) & (year_index["valid_minutes"].values > 0)
+
+    if min_valid_minutes is not None:
+        selected &= year_index["valid_minutes"].values >= min_valid_minutes
+    if max_valid_minutes is not None:
+        selected &= year_index["valid_minutes"].values <= max_valid_minutes
+    if max_longest_gap is not None:
+        selected &= year_index["longest_gap"].values <= max_longest_gap
+    if min_max_power is not None:
+        selected &= year_index["max_power"].values > min_max_power
+
+    return days[selected]
+
+
+def write_quality_index(path, quality_index):
+    """
+    Stores quality index as a .npz file
+    :param path: file path, should end in .npz
+    :param quality_index: quality index xarray
+    """
+    arrays = {name: quality_index[name].values for name in QUALITY_VARIABLES}
+
+    atomic_files.write_atomically(path, lambda temporary_path: numpy.savez(
+        temporary_path, year=quality_index["year"].values, day=quality_index["day"].values, **arrays))
+
+
+def read_quality_index(path):
+    """
+    :param path: .npz file written by write_quality_index
+    :return: quality index xarray
+    """
+    with numpy.load(path) as stored:
+        data_variables = {name: (("year", "day"), stored[name]) for name in QUALITY_VARIABLES}
+        return xarray.Dataset(data_variables, coords={"year": stored["year"], "day": stored["day"]})
@@ -66,17 +66,20 @@ def __get_poa_slope_models_for_day_ranges(year, first_day, last_day, latitude_lo
 
     latitudes = []
 
-    for latitude in range(latitude_low, latitude_high+1):
-        fmins = []
-        days = []
-        lmins = []
-        for d in range(first_day, last_day+1, 10):
-            fmin, lmin = pvlib_poa.get_first_and_last_nonzero_minute(latitude, 0, year, d)
-            if fmin is None or lmin is None:
-                continue
-            fmins.append(fmin)
-            lmins.append(lmin)
-            days.append(d)
+    # first and last minutes for every latitude and day are solved at once, rows are latitudes and columns days
+    all_latitudes = numpy.arange(latitude_low, latitude_high + 1)
+    all_days = numpy.arange(first_day, last_day + 1, 10)
+    all_fmins, all_lmins = pvlib_poa.get_first_and_last_nonzero_minutes(all_latitudes[:, numpy.newaxis], 0, year,
+                                                                        all_days[numpy.newaxis, :])
+
+    for i in range(len(all_latitudes)):
+        latitude = all_latitudes[i]
+
+        # skipping days without sunrise or sunset
+        valid = ~numpy.isnan(all_fmins[i])
+        fmins = all_fmins[i][valid]
+        lmins = all_lmins[i][valid]
+        days = all_days[valid]
 
         first_minutes_model = numpy.polynomial.polynomial.polyfit(days, fmins, 1)
         last_minutes_model = numpy.polynomial.polynomial.polyfit(days, lmins, 1)
@@ -111,19 +114,17 @@ def __xa_slice_to_first_last_and_days(xa_slice, year):
     last_minutes = []
     days = []
 
-    for day in xa_slice["day"].values:
-        xa_day = splitters.slice_xa(xa_slice, year, year, day, day)
-        xa_day = xa_day.dropna(dim="minute")
+    slice_days = xa_slice["day"].values
 
-        minutes = xa_day.minute.values
-        # print(minutes)
+    for record in splitters.iterate_days(xa_slice, year, slice_days.min(), year, slice_days.max()):
+        # print(record.minutes)
 
-        first, last = __minute_list_to_first_last(minutes)
+        first, last = __minute_list_to_first_last(record.minutes)
 
         if first is not None:
             first_minutes.append(first)
             last_minutes.append(last)
-            days.append(day)
+            days.append(record.day)
 
     return first_minutes, last_minutes, days
 
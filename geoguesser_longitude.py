@@ -1,5 +1,8 @@
 import statistics
 
+import numpy
+
+import day_quality
 import pvlib_poa
 import splitters
 
@@ -22,7 +25,7 @@ def longitude_from_solar_noon_solar_noon_poa(long0, solar_noon, solar_noon_poa):
     return long0 - (360 / 1440) * (solar_noon - solar_noon_poa)
 
 
-def estimate_longitude_based_on_year(year_xa):
+def estimate_longitude_based_on_year(year_xa, quality_index=None):
     """
     Estimates the longitude of a solar PV installation when one year of data is given.
     Hard coded values
@@ -32,6 +35,8 @@ def estimate_longitude_based_on_year(year_xa):
     for installations outside of Finland
 
     :param year_xa: One year long of xarray data
+    :param quality_index: optional quality index from solar_power_data_loader.get_quality_index, days with too many or
+    too few measurements are then skipped without slicing them from year_xa
     :return: estimated longitude
     """
 
@@ -40,21 +45,30 @@ def estimate_longitude_based_on_year(year_xa):
     # reading days from year_xa
     days = year_xa.day.values
 
+    candidate_days = None
+    if quality_index is not None:
+        # same limits as in __xa_dirty_get_first_last_minute_of_solar_output, 30% to 90% of the day measured. Other
+        # days are not read at all
+        candidate_days = day_quality.select_days(quality_index, year, days.min(), days.max(),
+                                                 min_valid_minutes=0.3 * 1440, max_valid_minutes=0.9 * 1440)
+
     # listing simulation parameters, CHANGE THESE IF
     simulation_longitude = 25
     simulation_latitude = 60
 
+    # solving simulated solar noon minutes of every day at once
+    simulated_solar_noons = pvlib_poa.get_solar_noons(year, days, simulation_latitude, simulation_longitude)
+    simulated_solar_noons = dict(zip(days, simulated_solar_noons))
+
     # list for simulated longitude values, needed as one value is simulated for each day
     longitudes = []
 
     # calculating a longitude for each day in year_xa
-    for day in days:
-        # spitting needed day from xa
-        day_xa = splitters.slice_xa(year_xa,year, year,day, day)
-        day_xa = day_xa.dropna(dim="minute")
+    for record in splitters.iterate_days(year_xa, year, days.min(), year, days.max(), days=candidate_days):
+        day = record.day
 
         # taking first and last minute values
-        fmin, lmin = __xa_dirty_get_first_last_minute_of_solar_output(day_xa)
+        fmin, lmin = __xa_dirty_get_first_last_minute_of_solar_output(record.minutes)
         if fmin is None or lmin is None:
             # skipping if returned none
             continue
@@ -62,8 +76,10 @@ def estimate_longitude_based_on_year(year_xa):
         # estimating solar noon based on them
         estimated_solar_noon = (fmin+lmin)/2
 
-        # simulating solar noon minute
-        simulated_solar_noon = pvlib_poa.get_solar_noon(year, day, simulation_latitude, simulation_longitude)
+        # simulated solar noon minute, skipping days when the sun doesn't rise or set at simulation coordinates
+        simulated_solar_noon = simulated_solar_noons[day]
+        if numpy.isnan(simulated_solar_noon):
+            continue
 
         # estimating longitude with the help of estimated solar noon, simulated solar noon and simulated solar noon parameters
         estimated_longitude = longitude_from_solar_noon_solar_noon_poa(simulation_longitude, estimated_solar_noon, simulated_solar_noon)
@@ -73,14 +89,11 @@ def estimate_longitude_based_on_year(year_xa):
     return statistics.mean(longitudes)
 
 
-def __xa_dirty_get_first_last_minute_of_solar_output(xa_day):
+def __xa_dirty_get_first_last_minute_of_solar_output(minutes):
     """
-    TAKES A SINGLE DAY FROM XA AND TRIES TO FIGURE OUT THE FIRST AND LAST VALID MINUTE IN IT.
+    TAKES THE NON-NAN MINUTES OF A SINGLE DAY AND TRIES TO FIGURE OUT THE FIRST AND LAST VALID MINUTE IN IT.
     FIRST OUTPUT VALUE SHOULD BEGIN A BLOCK AND SECOND SHOULD END IT, THIS RESULTS IN A RATHER LONG FUNCTION
     """
-    xa_day = xa_day.dropna(dim="minute")
-
-    minutes = xa_day.minute.values
 
     # returning None, None pair for inputs which might result in invalid values
     if len(minutes) / 1440 > 0.9:
@@ -1,6 +1,9 @@
 import math
+import os
+import tempfile
 
 import numpy
+import pandas
 
 import angler
 import polarplotter
@@ -29,6 +32,48 @@ def test_data_loading():  # works
     data = solar_power_data_loader.get_fmi_helsinki_data_as_xarray()
 
 
+def test_oomi_loading_speed(years=5):
+    ###############################################################
+    #   Benchmarks the C engine OOMI loader against the original python engine loader on a synthetic multi-year file
+    #   Both loaders should return identical xarrays
+    ###############################################################
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic-oomi.csv")
+        write_synthetic_oomi_csv(path, years)
+
+        start_time = time.time()
+        python_engine_data = solar_power_data_loader.__load_oomi_csv_as_xa_python_engine(path)
+        python_engine_time = time.time() - start_time
+
+        start_time = time.time()
+        c_engine_data = solar_power_data_loader.__load_oomi_csv_as_xa(path)
+        c_engine_time = time.time() - start_time
+
+    print("python engine: %.2f s, c engine: %.2f s, speedup %.1fx" % (python_engine_time, c_engine_time,
+                                                                      python_engine_time / c_engine_time))
+    print("identical outputs: " + str(python_engine_data.identical(c_engine_data)))
+
+
+def write_synthetic_oomi_csv(path, years):
+    """
+    Writes an OOMI style csv with a sine shaped day curve every 10 minutes, 2 header rows and a 6 row footer
+    :param path: output file path
+    :param years: amount of years to generate, starting from 2019
+    """
+    times = pandas.date_range("2019-01-01", periods=years * 365 * 144, freq="10min")
+    minutes = times.hour.values * 60 + times.minute.values
+    kwh = numpy.clip(numpy.sin((minutes - 240) / 960 * math.pi), 0, None) * 0.5
+
+    # OOMI files use decimal commas
+    kwh_strings = pandas.Series(kwh).map(lambda value: ("%.3f" % value).replace(".", ",")).values
+    rows = times.strftime("%Y-%m-%d %H:%M") + ";" + kwh_strings + ";"
+
+    with open(path, "wb") as csv_file:
+        csv_file.write("Kulutuspaikka;Synthetic;\nAika;Energia (kWh);\n".encode("latin-1"))
+        csv_file.write(("\n".join(rows) + "\n").encode("latin-1"))
+        csv_file.write("Yhteensä;0;\nKeskiarvo;0;\nMinimi;0;\nMaksimi;0;\n;;\nLähde: Oomi;;\n".encode("latin-1"))
+
+
 ####################################
 # Tests for data plotting
 ####################################
@@ -645,11 +690,48 @@ def test_fibonacci_grid_of_panel_angles_multiday(samples):
     polarplotter.plot_polar_scattermap_points_with_texts(numpy.degrees(best_tilts), numpy.degrees(best_azimuths), day_ns)
 
 def test_localized_lattice():
-    angler.get_fibonacci_distribution_tilts_azimuths_near_coordinate(15, 135, 10000, 0.2)
+    angler.get_fibonacci_distribution_tilts_azimuths_near_coordinate(15, 135, 10000, 0.2, plot=True)
+
+def test_adaptive_angle_search():
+    ###############################################################
+    #   Estimates panel angles of kuopio installation from cloud free days with coarse to fine lattice search
+    ###############################################################
+
+    data = solar_power_data_loader.get_fmi_kuopio_data_as_xarray()
+    year_data = splitters.slice_xa(data, 2018, 2018, 10, 350)
+    clear_days = cloud_free_day_finder.find_smooth_days_xa(year_data, 140, 220, 0.5)
+
+    tilt, azimuth, fitness, evaluations = angler.adaptive_angle_search(clear_days, config.KUOPIO_FMI_LATITUDE,
+                                                                       config.KUOPIO_FMI_LONGITUDE)
+
+    delta_degrees = angler.angle_distance_between_points(15, 217, tilt, azimuth)
+    print("predicted " + str(round(tilt, 2)) + " " + str(round(azimuth, 2)) + " delta degrees: "
+          + str(round(delta_degrees, 2)) + " using " + str(evaluations) + " evaluations")
+
+
+def test_continuous_angle_optimizer():
+    ###############################################################
+    #   Estimates panel angles of kuopio installation for each cloud free day with multi-start simplex searches
+    ###############################################################
+
+    data = solar_power_data_loader.get_fmi_kuopio_data_as_xarray()
+    year_data = splitters.slice_xa(data, 2018, 2018, 10, 350)
+    clear_days = cloud_free_day_finder.find_smooth_days_xa(year_data, 140, 220, 0.5)
+
+    for day in clear_days:
+        tilt, azimuth, fitness, evaluations = angler.optimize_angles_for_days([day], config.KUOPIO_FMI_LATITUDE,
+                                                                              config.KUOPIO_FMI_LONGITUDE)
+
+        delta_degrees = angler.angle_distance_between_points(15, 217, tilt, azimuth)
+        print("day " + str(day["day"].values[0]) + " predicted " + str(round(tilt, 2)) + " " + str(round(azimuth, 2))
+              + " delta degrees: " + str(round(delta_degrees, 2)) + " using " + str(evaluations) + " evaluations")
+
 
 #test_one_panel_angle()
 #test_fibonacci_grid_of_panel_angles()
 #test_localized_lattice()
+#test_adaptive_angle_search()
+#test_continuous_angle_optimizer()
 
 plot_multi_year_geolocations_on_map()
 #estimate_latitude()
@@ -0,0 +1,269 @@
+import json
+import os
+
+import numpy
+import xarray
+
+import atomic_files
+
+
+############################
+#   FUNCTIONS FOR STORING MEASUREMENTS IN A DENSE MEMORY-MAPPED CUBE
+#   POWER VALUES ARE STORED AS FLOAT32 IN A RAW .cube FILE OF SHAPE (YEARS, 366, 1440), MISSING MINUTES ARE NAN
+#   A SMALL .json SIDECAR HOLDS THE FIRST YEAR AND THE YEAR COUNT
+#   MINUTE m OF DAY d OF YEAR y IS AT cube[y - first_year, d - 1, m]
+############################
+
+# increment when the layout of .cube files changes
+CUBE_FORMAT_VERSION = 1
+
+DAYS_PER_YEAR = 366
+MINUTES_PER_DAY = 1440
+CUBE_DTYPE = numpy.float32
+
+
+def create_cube(cube_path, first_year, last_year, source=None):
+    """
+    Creates a new NaN filled cube on disk, overwrites existing cube at cube_path
+    :param cube_path: path without file extension, cube_path.cube and cube_path.json are created
+    :param first_year: first year stored in the cube, eq. 2017
+    :param last_year: last year stored in the cube, eq. 2021
+    :param source: optional description of where the data came from, stored in metadata
+    :return: cube(writable numpy memmap), metadata(dict)
+    """
+    directory = os.path.dirname(cube_path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+
+    metadata = {
+        "version": CUBE_FORMAT_VERSION,
+        "first_year": int(first_year),
+        "years": int(last_year - first_year + 1),
+        "days": DAYS_PER_YEAR,
+        "minutes": MINUTES_PER_DAY,
+        "dtype": numpy.dtype(CUBE_DTYPE).name,
+        "source": source
+    }
+
+    cube = numpy.memmap(cube_path + ".cube", dtype=CUBE_DTYPE, mode="w+", shape=__get_shape(metadata))
+    cube[:] = numpy.nan
+    cube.flush()
+
+    write_metadata(cube_path, metadata)
+
+    return cube, metadata
+
+
+def open_cube(cube_path, mode="r"):
+    """
+    Memory maps an existing cube. Nothing is read from disk before values are accessed, several processes can open
+    the same cube at the same time
+    :param cube_path: path without file extension
+    :param mode: "r" for read only, "r+" for writable
+    :return: cube(numpy memmap), metadata(dict)
+    """
+    metadata = read_metadata(cube_path)
+
+    if metadata.get("version") != CUBE_FORMAT_VERSION:
+        raise ValueError("Cube " + cube_path + " has unsupported format version " + str(metadata.get("version")))
+
+    cube = numpy.memmap(cube_path + ".cube", dtype=metadata["dtype"], mode=mode, shape=__get_shape(metadata))
+
+    return cube, metadata
+
+
+def cube_exists(cube_path):
+    return os.path.isfile(cube_path + ".cube") and os.path.isfile(cube_path + ".json")
+
+
+def read_metadata(cube_path):
+    with open(cube_path + ".json", "r") as metadata_file:
+        return json.load(metadata_file)
+
+
+def write_metadata(cube_path, metadata):
+    def write_json(temporary_path):
+        with open(temporary_path, "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+
+    atomic_files.write_atomically(cube_path + ".json", write_json)
+
+
+def write_cube_from_xarray(xa, cube_path, source=None):
+    """
+    Stores an xarray from solar_power_data_loader as a cube
+    :param xa: xarray with power data variable and year, day, minute coordinates
+    :param cube_path: path without file extension
+    :param source: optional description of where the data came from
+    :return: cube(writable numpy memmap), metadata(dict)
+    """
+    power = xa["power"].transpose("year", "day", "minute")
+    years = power["year"].values
+    days = power["day"].values
+    minutes = power["minute"].values
+
+    cube, metadata = create_cube(cube_path, years.min(), years.max(), source)
+
+    # copying one year at a time, xa coordinates may skip days and minutes so fancy indexing places them correctly
+    for year_index in range(len(years)):
+        year_view = get_year_view(cube, metadata, years[year_index])
+        year_view[numpy.ix_(days - 1, minutes)] = power.values[year_index]
+
+    cube.flush()
+
+    return cube, metadata
+
+
+def extend_cube_years(cube_path, cube, metadata, first_year, last_year):
+    """
+    Grows a cube so that it covers years first_year to last_year. Years after the stored ones are appended to the end
+    of the .cube file, earlier years require rewriting the file one year at a time
+    :param cube_path: path without file extension
+    :param cube: currently open cube, must not be used after this call
+    :param metadata: cube metadata
+    :param first_year: first year which must fit in the cube
+    :param last_year: last year which must fit in the cube
+    :return: cube(writable numpy memmap), metadata(dict) covering at least years first_year to last_year
+    """
+    stored_first_year = metadata["first_year"]
+    stored_last_year = stored_first_year + metadata["years"] - 1
+
+    new_first_year = min(first_year, stored_first_year)
+    new_last_year = max(last_year, stored_last_year)
+
+    if new_first_year == stored_first_year and new_last_year == stored_last_year:
+        return cube, metadata
+
+    cube.flush()
+    del cube
+
+    nan_year = numpy.full((metadata["days"], metadata["minutes"]), numpy.nan, dtype=metadata["dtype"])
+
+    if new_first_year == stored_first_year:
+        # appending nan years to the end of the file, stored values are not touched
+        with open(cube_path + ".cube", "ab") as cube_file:
+            for year in range(stored_last_year + 1, new_last_year + 1):
+                cube_file.write(nan_year.tobytes())
+    else:
+        # earlier years have to go to the start of the file, copying stored years after them one at a time
+        def write_cube(temporary_path):
+            stored_cube, stored_metadata = open_cube(cube_path, mode="r")
+            with open(temporary_path, "wb") as cube_file:
+                for year in range(new_first_year, new_last_year + 1):
+                    if stored_first_year <= year <= stored_last_year:
+                        stored_year = get_year_view(stored_cube, stored_metadata, year)
+                        cube_file.write(numpy.ascontiguousarray(stored_year).tobytes())
+                    else:
+                        cube_file.write(nan_year.tobytes())
+
+        atomic_files.write_atomically(cube_path + ".cube", write_cube)
+
+    metadata = dict(metadata)
+    metadata["first_year"] = int(new_first_year)
+    metadata["years"] = int(new_last_year - new_first_year + 1)
+    write_metadata(cube_path, metadata)
+
+    return open_cube(cube_path, mode="r+")
+
+
+def write_values(cube, metadata, years, days, minutes, powers):
+    """
+    Writes individual measurements to a writable cube
+    :param cube: cube opened with mode "r+" or returned by create_cube
+    :param metadata: cube metadata
+    :param years: array of years, must be within the years of the cube
+    :param days: array of days, 1 to 366
+    :param minutes: array of minutes, 0 to 1439
+    :param powers: array of power values
+    :return: None
+    """
+    years = numpy.asarray(years)
+    year_indexes = years - metadata["first_year"]
+
+    if len(year_indexes) > 0 and (year_indexes.min() < 0 or year_indexes.max() >= metadata["years"]):
+        raise ValueError("Years " + str(years.min()) + "-" + str(years.max()) + " are outside of cube years")
+
+    cube[year_indexes, numpy.asarray(days) - 1, numpy.asarray(minutes)] = powers
+
+
+def clear_days(cube, metadata, years, days):
+    """
+    Sets every minute of given days to nan
+    :param years: array of years
+    :param days: array of days, 1 to 366. Pairs of years and days may repeat
+    :return: None
+    """
+    year_indexes = numpy.asarray(years) - metadata["first_year"]
+    day_keys = numpy.unique(year_indexes * metadata["days"] + numpy.asarray(days) - 1)
+    cube[day_keys // metadata["days"], day_keys % metadata["days"]] = numpy.nan
+
+
+def get_year_view(cube, metadata, year):
+    """
+    :return: (366, 1440) view of the cube for year, no values are copied
+    """
+    return cube[__get_year_index(metadata, year)]
+
+
+def get_day_view(cube, metadata, year, day):
+    """
+    :param year: year, eq. 2018
+    :param day: day of year, 1 to 366
+    :return: 1440 long view of the cube for given day, index is minute. No values are copied
+    """
+    return cube[__get_year_index(metadata, year), day - 1]
+
+
+def get_day_minutes_and_powers(cube, metadata, year, day):
+    """
+    Same values as day_xa.dropna(dim="minute") would give for minutes and powers
+    :return: minutes, powers arrays of the non-nan minutes in given day
+    """
+    day_view = get_day_view(cube, metadata, year, day)
+    minutes = numpy.flatnonzero(~numpy.isnan(day_view))
+
+    return minutes, day_view[minutes]
+
+
+def get_years(metadata):
+    return numpy.arange(metadata["first_year"], metadata["first_year"] + metadata["years"])
+
+
+def cube_to_xarray(cube, metadata, chunks=None):
+    """
+    Wraps cube in an xarray with the same year, day, minute -structure as solar_power_data_loader xarrays. The cube is
+    not copied, so values are read from disk only when used. Every day of every year is present, unmeasured days are
+    nan
+    :param cube: cube from open_cube or create_cube
+    :param metadata: cube metadata
+    :param chunks: optional dask chunk sizes, eq. {"year": 1, "day": 16}. Returns a lazily evaluated xarray if given
+    :return: xarray with power data variable
+    """
+    xa = xarray.Dataset(
+        {"power": (("year", "day", "minute"), cube)},
+        coords={
+            "year": get_years(metadata),
+            "day": numpy.arange(1, metadata["days"] + 1),
+            "minute": numpy.arange(metadata["minutes"])
+        }
+    )
+
+    if chunks is not None:
+        xa = xa.chunk(chunks)
+
+    return xa
+
+
+############################
+#   HELPERS BELOW, CALL ONLY FROM WITHIN THIS FILE
+############################
+
+def __get_shape(metadata):
+    return metadata["years"], metadata["days"], metadata["minutes"]
+
+
+def __get_year_index(metadata, year):
+    year_index = int(year) - metadata["first_year"]
+    if year_index < 0 or year_index >= metadata["years"]:
+        raise ValueError("Year " + str(year) + " is not stored in cube")
+    return year_index
@@ -0,0 +1,91 @@
+import numpy
+
+
+############################
+#   FUNCTIONS FOR COMPARING MEASUREMENTS WITH SIMULATED POA
+#   MEASUREMENTS ARE GIVEN AS MINUTE AND POWER ARRAYS, POA AS AN ARRAY WITH A VALUE FOR EVERY MINUTE OF THE DAY
+#   POA MAY ALSO HAVE LEADING DIMENSIONS, FOR EXAMPLE ONE ROW PER TESTED ANGLE PAIR, DELTAS AND COSTS ARE THEN
+#   COMPUTED FOR EVERY ROW AT ONCE
+#   NORMS:
+#   "l1"        sum of absolute deltas
+#   "l2"        square root of the sum of squared deltas
+#   "relative"  mean of absolute percentual deltas, minutes where poa is not above MIN_RELATIVE_POA are skipped
+#   NORM MAY ALSO BE A FUNCTION WHICH TAKES DELTAS AND PERCENT DELTAS AND RETURNS COSTS OVER THE LAST AXIS
+############################
+
+MIN_MEASURED_POWER = 2  # measurements below this are left out of comparisons, the lowest values are mostly noise
+MIN_RELATIVE_POA = 1  # percentual deltas are nan where poa is not above this, avoids divisions by zero
+
+
+def get_day_arrays(xa_day, min_power=MIN_MEASURED_POWER):
+    """
+    Takes the minutes and powers which are used in comparisons from one day of measurements
+    :param xa_day: xarray containing one day of measurements
+    :param min_power: measurements below this and nans are dropped
+    :return: minutes, powers. Numpy arrays of equal length, powers as float64
+    """
+    minutes = xa_day["minute"].values
+
+    # measurements may be stored as float32, sums and deltas are computed in float64
+    powers = xa_day["power"].transpose(..., "minute").values.reshape(-1).astype(numpy.float64)
+
+    # nan comparisons are False, so this drops nans as well
+    kept = powers >= min_power
+
+    return minutes[kept], powers[kept]
+
+
+def get_deltas(minutes, powers, poa):
+    """
+    :param minutes: measured minutes, used as poa indexes
+    :param powers: measured powers
+    :param poa: array of shape (..., 1440) of simulated poa values
+    :return: deltas, percent_deltas. Arrays of shape (..., len(minutes)), percent deltas are nan where poa is not above
+    MIN_RELATIVE_POA
+    """
+    poa_at_minutes = numpy.asarray(poa)[..., minutes]
+    deltas = powers - poa_at_minutes
+
+    # poa power may be 0, avoiding zero divisions here
+    relative_valid = poa_at_minutes > MIN_RELATIVE_POA
+    percent_deltas = numpy.full(deltas.shape, numpy.nan)
+    numpy.divide(deltas * 100, poa_at_minutes, out=percent_deltas, where=relative_valid)
+
+    return deltas, percent_deltas
+
+
+def get_cost(deltas, percent_deltas, norm="l1"):
+    """
+    :param deltas: deltas from get_deltas
+    :param percent_deltas: percent deltas from get_deltas
+    :param norm: "l1", "l2", "relative" or a function, see the top of this file
+    :return: cost over the last axis, float for a single poa. Lower is better
+    """
+    if callable(norm):
+        return norm(deltas, percent_deltas)
+
+    if norm == "l1":
+        return numpy.abs(deltas).sum(axis=-1)
+    if norm == "l2":
+        return numpy.sqrt(numpy.square(deltas).sum(axis=-1))
+    if norm == "relative":
+        # a poa without any comparable minutes can't match the measurements
+        counts = numpy.count_nonzero(~numpy.isnan(percent_deltas), axis=-1)
+        sums = numpy.nansum(numpy.abs(percent_deltas), axis=-1)
+        return numpy.where(counts > 0, sums / numpy.maximum(counts, 1), numpy.inf)
+
+    raise ValueError("unknown norm " + str(norm) + ", use l1, l2, relative or a function")
+
+
+def get_measurement_to_poa_cost(minutes, powers, poa, norm="l1"):
+    """
+    Compares measurements with simulated poa
+    :param minutes: measured minutes from get_day_arrays
+    :param powers: measured powers from get_day_arrays
+    :param poa: array of shape (..., 1440) of simulated poa values, already scaled to measurements
+    :param norm: "l1", "l2", "relative" or a function, see the top of this file
+    :return: deltas, percent_deltas, cost
+    """
+    deltas, percent_deltas = get_deltas(minutes, powers, poa)
+
+    return deltas, percent_deltas, get_cost(deltas, percent_deltas, norm)
@@ -1,10 +1,18 @@
+import calendar
+import collections
+import hashlib
+import os
 from datetime import datetime
 
-import pandas
+import numpy
+from pvlib import atmosphere
+from pvlib import clearsky
 from pvlib import location
 from pvlib import irradiance
+from pvlib import spa
 import pandas as pd
 
+import atomic_files
 import config
 
 
@@ -12,7 +20,7 @@ import config
 #   FUNCTIONS FOR CREATING PLANE OF ARRAY IRRADIANCE CURVES
 ############################
 
-def get_irradiance_with_multiplier(year, lat, lon, day, tilt, facing, multiplier):
+def get_irradiance_with_multiplier(year, lat, lon, day, tilt, facing, multiplier, site=None):
     """
     :param year: Year to simulate for, example: 2021
     :param lat: Geographic latitude of the installation
@@ -21,10 +29,11 @@ def get_irradiance_with_multiplier(year, lat, lon, day, tilt, facing, multiplier
     :param tilt: Panel tilt, angle from horizon towards zenith
     :param facing: Horizontal component of panel angle, 0 for north, 90 for east, 180 for south
     :param multiplier: Related to panel area and efficiency. Useful for matching a POA curve with measurements
+    :param site: optional site context from get_site_context(lat, lon)
     :return: Pandas dataframe containing timestamps and irradiance values, resolution 1/minute
     """
     # Creating a pandas dataframe with one day of irradiance data
-    irradiance_day = get_irradiance(year, lat, lon, day, tilt, facing)
+    irradiance_day = get_irradiance(year, lat, lon, day, tilt, facing, site=site)
 
     # multiplying plane of array irradiance value by multiplier
     irradiance_day["POA"] = irradiance_day["POA"] * multiplier
@@ -55,13 +64,36 @@ def get_solar_noon(year, day, latitude, longitude):
 
 def get_first_and_last_nonzero_minute(latitude, longitude, year, day):
     """
-    BROKEN FUNCTION
-    Returns solar noon minute when longitude, latitude, year and day are known.
-    :param latitude:
-    :param longitude:
-    :param year:
-    :param day:
-    :return:
+    Returns the first and last minute of the day when clear sky POA is above zero, which is when the apparent solar
+    elevation is above zero. Solved from solar position equations, see get_first_and_last_nonzero_minutes
+    :param latitude: -90 to 90
+    :param longitude: -180 to 180
+    :param year: year, eq. 2021
+    :param day: day of year
+    :return: first, last -minute. Values may be below 0 or above 1439 if daylight continues over utc midnight.
+    None, None for polar night and for days with more than 1420 minutes of daylight
+    """
+    first_minutes, last_minutes = get_first_and_last_nonzero_minutes(latitude, longitude, year, day)
+
+    if numpy.isnan(first_minutes):
+        return None, None
+
+    return int(first_minutes), int(last_minutes)
+
+
+def get_first_and_last_nonzero_minute_from_poa(latitude, longitude, year, day):
+    """
+    Reference for the sun event solver. Simulates a whole day of POA for a 15 degree south facing panel and returns
+    the first and last minutes with POA above 0. get_first_and_last_nonzero_minutes is much faster, this is kept as the
+    ground truth of validate_first_and_last_nonzero_minutes.
+    Limitations: days with more than 1420 nonzero minutes and polar nights return None, None. When daylight crosses
+    UTC midnight the first gap in the minutes decides the wrapped form, (first < 0, last) or (first, last > 1439), so
+    results near midnight may differ from the solver by the equivalent 1440 minute shift
+    :param latitude: Geographic latitude
+    :param longitude: Geographic longitude
+    :param year: Year, example: 2021
+    :param day: Day of year
+    :return: first_minute, last_minute. None, None if there is no sunrise or sunset
     """
     config.YEAR = year
     poa = get_irradiance(year, latitude, longitude, day, 15, 180)
@@ -129,49 +161,79 @@ def get_first_and_last_nonzero_minute(latitude, longitude, year, day):
 
 
 
-def get_irradiance(year, lat, lon, day, tilt, facing):
+def get_irradiance(year, lat, lon, day, tilt, facing, use_cache=True, site=None):
     """
     Main irradiance estimation function. Based on code from pvlib tutorial:
     https://pvlib-python.readthedocs.io/en/stable/gallery/irradiance-transposition/plot_ghi_transposition.html
+    Simulated days are cached, see FUNCTIONS FOR CACHING POA SIMULATIONS. Coordinates and angles are rounded to
+    config.POA_CACHE_COORDINATE_DECIMALS and config.POA_CACHE_ANGLE_DECIMALS decimals before simulating
+    :param use_cache: if False, the cache is neither read nor written
+    :param site: optional site context from get_site_context(lat, lon), looked up from memory if not given
+    :return: Pandas dataframe with minute and POA columns, indexed by timestamps. Returned dataframe can be modified
     """
+    key = __get_poa_cache_key(year, lat, lon, day, tilt, facing)
 
-    # creating site data required by pvlib poa
-    tz = 'GMT'  # assuming that measurements are in UTZ GMT time
-    #year = config.YEAR  # loading year from config file
-    site = location.Location(lat, lon, tz=tz)
+    if not use_cache:
+        return __simulate_irradiance(*key, use_cache=False, site=site)
 
-    # creating a pandas entity containing the times for which the irradiance is modeled for
-    date = datetime.strptime(str(year) + "-" + str(day), "%Y-%j").strftime("%m-%d-%Y")
+    return __get_cached_irradiance(key, site)
+
+
+def get_sky_for_day(year, lat, lon, day, use_cache=True, site=None):
+    """
+    Clear sky irradiance and solar position of every minute of a day. These depend only on the site and the day, so
+    one sky can be transposed to any amount of panel angles with get_irradiance_from_sky. Skies are cached in the
+    same in-process cache as poa days
+    :param year: Year to simulate for, example: 2021
+    :param lat: Geographic latitude of the installation
+    :param lon: Geographic longitude of the installation
+    :param day: Day of year
+    :param use_cache: if False, the cache is neither read nor written
+    :param site: optional site context from get_site_context(lat, lon), looked up from memory if not given
+    :return: Pandas dataframe with minute, dni, ghi, dhi, apparent_zenith and azimuth columns, indexed by timestamps.
+    Should not be modified as the same dataframe is returned from cache
+    """
+    key = ("sky",) + __get_poa_cache_key(year, lat, lon, day, 0, 0)[:4]
+
+    if not use_cache:
+        return __simulate_sky(*key[1:], site=site)
 
-    times = pd.date_range(date,  # year + day for which the irradiance is calculated
-                          freq='1min',  # take measurement every 1 minute
-                          periods=60 * 24,  # how many measurements, 60 * 24 for 60 times per 24 hours = 1440
-                          tz=site.tz)  # timezone, using gmt
+    if key in __poa_cache:
+        __poa_cache.move_to_end(key)
+        __poa_cache_statistics["sky_hits"] += 1
+        return __poa_cache[key]
 
-    # creating a clear sky and solar position entities
-    clearsky = site.get_clearsky(times)
-    solar_position = site.get_solarposition(times=times)
+    __poa_cache_statistics["sky_misses"] += 1
+    sky = __simulate_sky(*key[1:], site=site)
+    __store_in_memory(key, sky)
+
+    return sky
+
+
+def get_irradiance_from_sky(sky, tilt, facing):
+    """
+    Transposes a sky from get_sky_for_day to a panel plane. Much faster than get_irradiance when many panel angles
+    are tested against the same day
+    :param sky: dataframe from get_sky_for_day
+    :param tilt: Panel tilt, angle from horizon towards zenith
+    :param facing: Horizontal component of panel angle, 0 for north, 90 for east, 180 for south
+    :return: Pandas dataframe with minute and POA columns, indexed by timestamps. Same as get_irradiance would return
+    """
 
     # creating PVlib plane of array irradiance dataframe
     POA_irradiance = irradiance.get_total_irradiance(
         surface_tilt=tilt,
         surface_azimuth=facing,
-        dni=clearsky['dni'],
-        ghi=clearsky['ghi'],
-        dhi=clearsky['dhi'],
-        solar_zenith=solar_position['apparent_zenith'],
-        solar_azimuth=solar_position['azimuth'])
-
-    # turning the times dataframe to a list of minutes
-    times = clearsky.index.time
-    minutes = []
-    for time in times:
-        minutes.append(time.hour * 60 + time.minute)
+        dni=sky['dni'],
+        ghi=sky['ghi'],
+        dhi=sky['dhi'],
+        solar_zenith=sky['apparent_zenith'],
+        solar_azimuth=sky['azimuth'])
 
     # creating the output dataframe which consists of only necessary data, minutes and corresponding poa values
     output_df = pd.DataFrame(
         {
-            "minute": minutes,
+            "minute": sky["minute"].values,
             'POA': POA_irradiance['poa_global']
         }
     )
@@ -179,30 +241,820 @@ def get_irradiance(year, lat, lon, day, tilt, facing):
     return output_df
 
 
-def create_poa_df_for_year(year, lat, lon, tilt, facing):
+def get_irradiance_matrix(sky, tilts, facings, albedo=0.25):
+    """
+    Transposes a sky to many panel angles at once. Same isotropic sky model as pvlib.irradiance.get_total_irradiance
+    uses in get_irradiance_from_sky, but the angle of incidence, beam, sky diffuse and ground reflected terms are
+    broadcast over every angle pair instead of computed one pair at a time. Angles are processed
+    config.POA_MATRIX_CHUNK_ANGLES at a time
+    :param sky: dataframe from get_sky_for_day
+    :param tilts: array of N panel tilts in degrees
+    :param facings: array of N panel facings in degrees, 0 for north, 90 for east, 180 for south
+    :param albedo: ground reflectance, pvlib default is 0.25
+    :return: (N, minutes) numpy array of POA values, row i matches get_irradiance_from_sky(sky, tilts[i], facings[i])
+    """
+    tilts = numpy.atleast_1d(numpy.asarray(tilts, dtype=float))
+    facings = numpy.atleast_1d(numpy.asarray(facings, dtype=float))
+
+    if tilts.shape != facings.shape or tilts.ndim != 1:
+        raise ValueError("tilts and facings must be 1 dimensional arrays of the same length")
+
+    dni = sky["dni"].values
+    ghi = sky["ghi"].values
+    dhi = sky["dhi"].values
+    cos_zenith = numpy.cos(numpy.radians(sky["apparent_zenith"].values))
+    sin_zenith = numpy.sin(numpy.radians(sky["apparent_zenith"].values))
+    solar_azimuth = sky["azimuth"].values
+
+    poa_matrix = numpy.empty((len(tilts), len(sky)))
+
+    chunk_size = config.POA_MATRIX_CHUNK_ANGLES
+    for start in range(0, len(tilts), chunk_size):
+        # angles as columns, so that they broadcast against minutes as rows
+        tilt = tilts[start:start + chunk_size, numpy.newaxis]
+        facing = facings[start:start + chunk_size, numpy.newaxis]
+        cos_tilt = numpy.cos(numpy.radians(tilt))
+
+        # cosine of angle of incidence, clipped like in pvlib.irradiance.aoi_projection
+        projection = cos_tilt * cos_zenith + numpy.sin(numpy.radians(tilt)) * sin_zenith * numpy.cos(
+            numpy.radians(solar_azimuth - facing))
+        aoi = numpy.degrees(numpy.arccos(numpy.clip(projection, -1, 1)))
+
+        beam = numpy.maximum(dni * numpy.cos(numpy.radians(aoi)), 0)
+        sky_diffuse = dhi * (1 + cos_tilt) * 0.5
+        ground_diffuse = ghi * albedo * (1 - cos_tilt) * 0.5
+
+        poa_matrix[start:start + chunk_size] = beam + (sky_diffuse + ground_diffuse)
+
+    return poa_matrix
+
+
+def get_sky_for_days(year, lat, lon, days, site=None):
+    """
+    Same as get_sky_for_day but for many days at once. Clear sky and solar position are computed in one call over a
+    single time index, which is much faster than simulating days one by one. Not cached
+    :param year: Year to simulate for, example: 2021
+    :param lat: Geographic latitude of the installation
+    :param lon: Geographic longitude of the installation
+    :param days: list of days of year, 1 to 365 or 366
+    :param site: optional site context from get_site_context(lat, lon), looked up from memory if not given
+    :return: Pandas dataframe with day, minute, dni, ghi, dhi, apparent_zenith and azimuth columns, 1440 rows per day
+    in the order of days
+    """
+    days = numpy.asarray(days, dtype=numpy.int64)
+
+    # one minute for every minute of every day, without creating a date range per day
+    first_minute_of_year = pd.Timestamp(year=int(year), month=1, day=1, tz='GMT')
+    minute_offsets = (days[:, numpy.newaxis] - 1) * 1440 + numpy.arange(1440)
+    times = first_minute_of_year + pd.to_timedelta(minute_offsets.ravel(), unit="min")
+
+    sky = __simulate_sky_at_times(lat, lon, times, site)
+    sky.insert(0, "day", numpy.repeat(days, 1440))
+
+    return sky
+
+
+def get_irradiance_for_days(year, lat, lon, days, tilt, facing, site=None):
+    """
+    Year scale simulation, one pvlib call for clear sky, solar position and transposition for all given days
+    :param year: Year to simulate for, example: 2021
+    :param lat: Geographic latitude of the installation
+    :param lon: Geographic longitude of the installation
+    :param days: list of days of year, 1 to 365 or 366
+    :param tilt: Panel tilt, angle from horizon towards zenith
+    :param facing: Horizontal component of panel angle, 0 for north, 90 for east, 180 for south
+    :param site: optional site context from get_site_context(lat, lon)
+    :return: (len(days), 1440) numpy array of POA values, index is [day position, minute]
+    """
+    sky = get_sky_for_days(year, lat, lon, days, site)
+    poa = get_irradiance_from_sky(sky, tilt, facing)
+
+    return poa["POA"].values.reshape(-1, 1440)
+
+
+def create_poa_df_for_year(year, lat, lon, tilt, facing, site=None):
     """
     :param year:   year to create poa for
     :param lat:     latitude
     :param lon:     longitude
     :param tilt:    panel tilt
     :param facing:  panel facing
-    :return: pandas dataframe containing 365 poa models, one for each day of the year with given parameters
+    :param site:    optional site context from get_site_context(lat, lon)
+    :return: pandas dataframe containing 365 or 366 poa models, one for each day of the year with given parameters
     """
-    config.YEAR = year
-    return create_poa_df_for_range(range(0, 365), lat, lon, tilt, facing)
+    days_in_year = 366 if calendar.isleap(year) else 365
+    return create_poa_df_for_range(year, range(1, days_in_year + 1), lat, lon, tilt, facing, site)
 
 
-def create_poa_df_for_range(list_of_day_numbers, lat, lon, tilt, facing):
+def create_poa_df_for_range(year, list_of_day_numbers, lat, lon, tilt, facing, site=None):
     """
-    Creates a POA DF for each day in list of day numbers, using given latitude, longitude, tilt and facing
+    Creates a POA DF for each day in list of day numbers, using given year, latitude, longitude, tilt and facing. All
+    days are simulated at once
+    :return: pandas dataframe with minute, POA and day columns, indexed by timestamps
     """
+    sky = get_sky_for_days(year, lat, lon, list_of_day_numbers, site)
 
-    poa_days = []
-    for day in list_of_day_numbers:
-        poa_day = get_irradiance(lat, lon, day, tilt, facing)
-        poa_day["day"] = day
-        poa_days.append(poa_day)
-
-    year_poa_df = pandas.concat(poa_days)
+    year_poa_df = get_irradiance_from_sky(sky, tilt, facing)
+    year_poa_df["day"] = sky["day"].values
 
     return year_poa_df
+
+
+############################
+#   FUNCTIONS FOR LINEAR BASIS POA
+#   WITH PANEL NORMAL n AND SUN DIRECTION s, ISOTROPIC POA IS
+#   dni * max(0, n.s) + dhi * (1 + n_z) / 2 + ghi * albedo * (1 - n_z) / 2
+#   WHICH IS A CLIPPED LINEAR FUNCTION OF n. A BASIS HOLDS THE CURVES dni * s AND THE DIFFUSE TERMS FOR ONE SKY, AFTER
+#   WHICH POA OF ANY PANEL ANGLES IS A MATRIX PRODUCT AND A CLIP. RESULTS MATCH get_irradiance_matrix UP TO FLOATING
+#   POINT ROUNDING, BUT THE EXACT FUNCTIONS SHOULD STILL BE USED FOR FINAL RESULTS
+############################
+
+def get_poa_basis(sky, albedo=0.25):
+    """
+    Precomputes basis curves from one solar geometry pass
+    :param sky: dataframe from get_sky_for_day, or any rows of it
+    :param albedo: ground reflectance, pvlib default is 0.25
+    :return: dict with minute (M,) array, beam (3, M) array of dni times sun direction x, y, z components, constant
+    (M,) array of diffuse poa of a vertical panel and vertical (M,) array of diffuse poa change per panel normal z
+    """
+    zenith = numpy.radians(sky["apparent_zenith"].values)
+    azimuth = numpy.radians(sky["azimuth"].values)
+    dni = sky["dni"].values
+
+    # same axes as panel normals in __get_panel_normals, x towards north, y towards east and z towards zenith
+    beam = dni * numpy.stack([numpy.sin(zenith) * numpy.cos(azimuth), numpy.sin(zenith) * numpy.sin(azimuth),
+                              numpy.cos(zenith)])
+
+    sky_diffuse = sky["dhi"].values * 0.5
+    ground_diffuse = sky["ghi"].values * albedo * 0.5
+
+    return {
+        "minute": sky["minute"].values,
+        "beam": beam,
+        "constant": sky_diffuse + ground_diffuse,
+        "vertical": sky_diffuse - ground_diffuse
+    }
+
+
+def get_irradiance_from_basis(basis, tilts, facings):
+    """
+    Surrogate of get_irradiance_matrix, POA for any amount of panel angles from a basis
+    :param basis: dict from get_poa_basis
+    :param tilts: array of N panel tilts in degrees
+    :param facings: array of N panel facings in degrees, 0 for north, 90 for east, 180 for south
+    :return: (N, minutes) numpy array of POA values
+    """
+    normals = __get_panel_normals(tilts, facings)
+
+    # max(0, dni * n.s) is the same as dni * max(0, n.s) as dni is never negative
+    poa = numpy.maximum(normals @ basis["beam"], 0)
+    poa += basis["constant"]
+    poa += normals[:, 2:3] * basis["vertical"]
+
+    return poa
+
+
+############################
+#   FUNCTIONS FOR DAYLIGHT ONLY POA SIMULATION
+#   WINDOWED SIMULATIONS COMPUTE SOLAR POSITION, CLEAR SKY AND TRANSPOSITION ONLY FOR MINUTES BETWEEN FIRST AND LAST
+#   MINUTE OF A WINDOW. POA OUTSIDE OF THE DAYLIGHT WINDOW IS ZERO, SO NIGHT MINUTES ARE NOT SIMULATED AT ALL
+#   DAYLIGHT WINDOWS ARE SOLVED FOR A WHOLE YEAR AT A TIME AND KEPT IN MEMORY
+############################
+
+# site and year -> first and last daylight minute arrays, index is day - 1
+__daylight_windows = dict()
+
+
+def get_daylight_window(year, lat, lon, day, margin=None):
+    """
+    Minutes between which the sun is up, solved without simulating poa. First call for a site and year solves every
+    day of the year at once, later calls are lookups
+    :param year: Year to simulate for, example: 2021
+    :param lat: Geographic latitude of the installation
+    :param lon: Geographic longitude of the installation
+    :param day: Day of year
+    :param margin: minutes added to both ends of the window, config.DAYLIGHT_WINDOW_MARGIN_MINUTES if None
+    :return: first_minute, last_minute. Whole day 0, 1439 if daylight continues over utc midnight, the sun is up at an
+    end of the utc day outside of the window or the sun doesn't rise and set
+    """
+    if margin is None:
+        margin = config.DAYLIGHT_WINDOW_MARGIN_MINUTES
+
+    window_key = __get_poa_cache_key(year, lat, lon, 0, 0, 0)[:3]
+    if window_key not in __daylight_windows:
+        days = numpy.arange(1, 367)
+        first_minutes, last_minutes = get_first_and_last_nonzero_minutes(window_key[1], window_key[2], window_key[0],
+                                                                         days)
+
+        # the sun may also be up at an end of the utc day outside of the solved sunrise-sunset period, for example
+        # when the next sunrise is just before the end of the utc day
+        day_start_seconds = __get_day_start_seconds(numpy.full(len(days), window_key[0]), days)
+        latitudes = numpy.full(len(days), window_key[1])
+        longitudes = numpy.full(len(days), window_key[2])
+        end_elevations = __get_apparent_elevations(day_start_seconds, latitudes, longitudes,
+                                                   __get_site_altitudes(latitudes, longitudes),
+                                                   numpy.stack([numpy.zeros(len(days)), numpy.full(len(days), 1439)]))
+
+        __daylight_windows[window_key] = first_minutes, last_minutes, end_elevations[0] > 0, end_elevations[1] > 0
+
+    first_minutes, last_minutes, up_at_starts, up_at_ends = __daylight_windows[window_key]
+    first_minute = first_minutes[int(day) - 1]
+    last_minute = last_minutes[int(day) - 1]
+
+    # windows are continuous, daylight at both ends of the utc day is simulated as a whole day. Daylight wraps over
+    # utc midnight when sunrise is before the start or sunset after the end of the utc day
+    if numpy.isnan(first_minute) or first_minute < 0 or last_minute > 1439:
+        return 0, 1439
+
+    first_minute = max(int(first_minute) - margin, 0)
+    last_minute = min(int(last_minute) + margin, 1439)
+
+    if (up_at_starts[int(day) - 1] and first_minute > 0) or (up_at_ends[int(day) - 1] and last_minute < 1439):
+        return 0, 1439
+
+    return first_minute, last_minute
+
+
+def get_sky_for_window(year, lat, lon, day, first_minute, last_minute, site=None):
+    """
+    Same as get_sky_for_day but only for minutes first_minute to last_minute. Not cached
+    :param first_minute: first simulated minute, 0 to 1439
+    :param last_minute: last simulated minute, inclusive
+    :param site: optional site context from get_site_context(lat, lon)
+    :return: Pandas dataframe with minute, dni, ghi, dhi, apparent_zenith and azimuth columns, indexed by timestamps
+    """
+    times = __get_day_times(year, day, 'GMT')[int(first_minute):int(last_minute) + 1]
+
+    return __simulate_sky_at_times(lat, lon, times, site)
+
+
+def get_irradiance_for_window(year, lat, lon, day, tilt, facing, first_minute=None, last_minute=None, site=None):
+    """
+    Daylight only version of get_irradiance. Simulation time is proportional to the window length
+    :param year: Year to simulate for, example: 2021
+    :param lat: Geographic latitude of the installation
+    :param lon: Geographic longitude of the installation
+    :param day: Day of year
+    :param tilt: Panel tilt, angle from horizon towards zenith
+    :param facing: Horizontal component of panel angle, 0 for north, 90 for east, 180 for south
+    :param first_minute: first simulated minute, for example first minute of a measured day. Solved daylight window is
+    used if first_minute or last_minute is None
+    :param last_minute: last simulated minute, inclusive
+    :param site: optional site context from get_site_context(lat, lon)
+    :return: Pandas dataframe with minute and POA columns for window minutes, indexed by timestamps
+    """
+    if first_minute is None or last_minute is None:
+        first_minute, last_minute = get_daylight_window(year, lat, lon, day)
+
+    sky = get_sky_for_window(year, lat, lon, day, first_minute, last_minute, site)
+
+    # numpy transposition gives the same values as get_irradiance_from_sky without pandas overhead, which would
+    # otherwise dominate the simulation time of short windows
+    return pd.DataFrame({"minute": sky["minute"].values, "POA": get_irradiance_matrix(sky, [tilt], [facing])[0]},
+                        index=sky.index)
+
+
+def expand_window_to_day(windowed_poa, year, day):
+    """
+    Expands windowed poa to all 1440 minutes of the day, minutes outside of the window get 0 POA
+    :param windowed_poa: dataframe from get_irradiance_for_window
+    :param year: year of windowed_poa
+    :param day: day of windowed_poa
+    :return: Pandas dataframe with minute and POA columns, same format as get_irradiance returns
+    """
+    poa = numpy.zeros(1440)
+    poa[windowed_poa["minute"].values] = windowed_poa["POA"].values
+
+    return pd.DataFrame({"minute": numpy.arange(1440), "POA": poa}, index=__get_day_times(year, day, 'GMT'))
+
+
+############################
+#   FUNCTIONS FOR SITE CONTEXTS
+#   pvlib READS SITE ALTITUDE AND MONTHLY LINKE TURBIDITIES FROM ITS BUNDLED CLIMATOLOGY FILES ON EVERY SIMULATION
+#   A SITE CONTEXT HOLDS THESE FOR ONE SITE. CONTEXTS ARE CREATED ONCE PER SITE AND KEPT IN MEMORY, SO SIMULATIONS
+#   WHICH USE THEM DON'T READ FILES
+############################
+
+SiteContext = collections.namedtuple("SiteContext", ["latitude", "longitude", "location", "monthly_linke_turbidities"])
+
+__site_contexts = dict()
+
+
+def get_site_context(lat, lon):
+    """
+    Returns the site context of given coordinates, creates it on first call. Coordinates are rounded like in
+    get_irradiance
+    :param lat: Geographic latitude of the installation
+    :param lon: Geographic longitude of the installation
+    :return: SiteContext with rounded latitude and longitude, pvlib Location with looked up altitude and 12 monthly
+    Linke turbidities multiplied by 20 as stored in pvlib climatology
+    """
+    site_key = __get_poa_cache_key(0, lat, lon, 0, 0, 0)[1:3]
+
+    if site_key not in __site_contexts:
+        __site_contexts[site_key] = __create_site_context(*site_key)
+
+    return __site_contexts[site_key]
+
+
+def get_linke_turbidity(site, times):
+    """
+    Same as pvlib.clearsky.lookup_linke_turbidity with interpolation between months, but from the site context
+    :param site: site context from get_site_context
+    :param times: pandas DatetimeIndex in utc or gmt
+    :return: numpy array of Linke turbidities, one for each time
+    """
+    # monthly values are at month middles, previous december and next january are added for interpolating the ends
+    monthly_values = site.monthly_linke_turbidities
+    monthly_values = numpy.concatenate([monthly_values[-1:], monthly_values, monthly_values[:1]])
+
+    days_of_year = numpy.asarray(times.dayofyear)
+    leap_turbidities = numpy.interp(days_of_year, __get_month_middles(True), monthly_values)
+    turbidities = numpy.interp(days_of_year, __get_month_middles(False), monthly_values)
+
+    return numpy.where(numpy.asarray(times.is_leap_year), leap_turbidities, turbidities) / 20.
+
+
+############################
+#   FUNCTIONS FOR SOLVING FIRST AND LAST MINUTES OF DAYLIGHT
+#   THE SUN IS UP WHEN APPARENT ELEVATION FROM pvlib.spa IS ABOVE ZERO, WHICH IS ALSO WHEN CLEAR SKY POA IS ABOVE ZERO
+#   SUNRISE AND SUNSET ARE ESTIMATED WITH NOAA EQUATIONS AND REFINED BY ROOT FINDING, ALL DAYS AND SITES AT ONCE
+############################
+
+def get_first_and_last_nonzero_minutes(latitudes, longitudes, years, days):
+    """
+    Vectorized version of get_first_and_last_nonzero_minute, arguments are broadcast against each other
+    :param latitudes: latitude or array of latitudes
+    :param longitudes: longitude or array of longitudes
+    :param years: year or array of years
+    :param days: day or array of days
+    :return: first minutes, last minutes as float arrays of whole minutes, nan where get_first_and_last_nonzero_minute
+    would return None
+    """
+    latitudes, longitudes, years, days = numpy.broadcast_arrays(numpy.asarray(latitudes, dtype=float),
+                                                                numpy.asarray(longitudes, dtype=float),
+                                                                numpy.asarray(years, dtype=numpy.int64),
+                                                                numpy.asarray(days, dtype=numpy.int64))
+    shape = latitudes.shape
+    latitudes, longitudes, years, days = latitudes.ravel(), longitudes.ravel(), years.ravel(), days.ravel()
+
+    day_start_seconds = __get_day_start_seconds(years, days)
+
+    altitudes = __get_site_altitudes(latitudes, longitudes)
+    noons, half_days = __estimate_sun_event_minutes(latitudes, longitudes, days)
+
+    first_minutes, last_minutes, noon_is_up = __solve_sun_events(day_start_seconds, latitudes, longitudes, altitudes,
+                                                                 noons, half_days)
+
+    # daylight which continues over utc midnight is split in two parts of the utc day. Like in the poa based version,
+    # the part at the other end of the day belongs to the previous or next sunrise-sunset period. Near polar day the
+    # sun may not set at the midnight before noon, but set at the midnight after it and rise again before the utc day
+    # ends, or the other way around. The missing sunrise or sunset is then also taken from the adjacent period
+    no_sunrise = noon_is_up & numpy.isnan(first_minutes) & ~numpy.isnan(last_minutes)
+    no_sunset = noon_is_up & numpy.isnan(last_minutes) & ~numpy.isnan(first_minutes)
+    for wraps, period_offset in [((first_minutes < 0) | no_sunrise, 1440), ((last_minutes > 1439) | no_sunset, -1440)]:
+        if not numpy.any(wraps):
+            continue
+
+        adjacent_firsts, adjacent_lasts, adjacent_noon_is_up = __solve_sun_events(
+            day_start_seconds[wraps], latitudes[wraps], longitudes[wraps], altitudes[wraps], noons[wraps] + period_offset,
+            half_days[wraps])
+
+        if period_offset > 0:
+            # first minute of the evening daylight, 0 if the next sunrise is after the end of the utc day or doesn't
+            # exist, in which case daylight continues from the start of the utc day
+            first_minutes[wraps] = numpy.where(adjacent_firsts <= 1439, adjacent_firsts - 1440, 0)
+        else:
+            # last minute of the morning daylight, 1439 if the previous sunset is before the start of the utc day or
+            # doesn't exist
+            last_minutes[wraps] = numpy.where(adjacent_lasts >= 0, adjacent_lasts + 1440, 1439)
+
+    # days with more than 1420 minutes of daylight are treated like midnight sun, as in the poa based version
+    valid = ~numpy.isnan(first_minutes) & ~numpy.isnan(last_minutes) & (last_minutes - first_minutes + 1 <= 1420)
+    first_minutes = numpy.where(valid, first_minutes, numpy.nan)
+    last_minutes = numpy.where(valid, last_minutes, numpy.nan)
+
+    return first_minutes.reshape(shape), last_minutes.reshape(shape)
+
+
+def get_solar_noons(years, days, latitudes, longitudes):
+    """
+    Vectorized version of get_solar_noon, arguments are broadcast against each other
+    :return: float array of solar noon minutes, nan where get_solar_noon would return None
+    """
+    first_minutes, last_minutes = get_first_and_last_nonzero_minutes(latitudes, longitudes, years, days)
+
+    solar_noons = (first_minutes + last_minutes) / 2
+
+    return numpy.where(solar_noons > 1439, solar_noons - 1440, solar_noons)
+
+
+def validate_first_and_last_nonzero_minutes(latitudes, longitudes, year, days, tolerance=None):
+    """
+    Compares solved first and last minutes with get_first_and_last_nonzero_minute_from_poa for every latitude,
+    longitude and day combination. Slow, simulates a day of poa per combination
+    :param latitudes: list of latitudes
+    :param longitudes: list of longitudes
+    :param year: year, eq. 2021
+    :param days: list of days
+    :param tolerance: accepted difference in minutes, defaults to config.SUN_EVENT_TOLERANCE_MINUTES
+    :return: largest difference in minutes, list of (latitude, longitude, day) combinations which differ more than
+    tolerance or where only one of the methods returns None
+    """
+    if tolerance is None:
+        tolerance = config.SUN_EVENT_TOLERANCE_MINUTES
+
+    largest_difference = 0
+    mismatches = []
+
+    for latitude in latitudes:
+        for longitude in longitudes:
+            first_minutes, last_minutes = get_first_and_last_nonzero_minutes(latitude, longitude, year, days)
+            for i in range(len(days)):
+                first, last = get_first_and_last_nonzero_minute_from_poa(latitude, longitude, year, days[i])
+
+                if first is None or numpy.isnan(first_minutes[i]):
+                    if first is not None or not numpy.isnan(first_minutes[i]):
+                        mismatches.append((latitude, longitude, days[i]))
+                    continue
+
+                difference = max(abs(first - first_minutes[i]), abs(last - last_minutes[i]))
+                largest_difference = max(largest_difference, difference)
+                if difference > tolerance:
+                    mismatches.append((latitude, longitude, days[i]))
+
+    return largest_difference, mismatches
+
+
+############################
+#   FUNCTIONS FOR CACHING POA SIMULATIONS
+#   SIMULATED DAYS AND SKIES ARE KEPT IN AN IN-PROCESS LEAST RECENTLY USED CACHE WHICH IS BOUNDED BY
+#   config.POA_CACHE_MAX_BYTES
+#   IF config.POA_CACHE_DIRECTORY IS SET, DAYS ARE ALSO STORED THERE AS .npz FILES AND REUSED BY LATER RUNS
+############################
+
+# increment when simulation changes, old disk cache files are then ignored
+POA_CACHE_FORMAT_VERSION = 1
+
+__poa_cache = collections.OrderedDict()
+__poa_cache_statistics = {"hits": 0, "disk_hits": 0, "misses": 0, "sky_hits": 0, "sky_misses": 0, "evictions": 0,
+                          "bytes": 0}
+
+
+def get_poa_cache_statistics():
+    """
+    :return: dict with hit, disk hit, miss and eviction counts, and entry count and size of the in-process cache.
+    hits, disk_hits and misses count poa lookups, sky_hits and sky_misses count sky lookups. A poa miss also looks up
+    a sky, which is counted only in the sky counters
+    """
+    statistics = dict(__poa_cache_statistics)
+    statistics["entries"] = len(__poa_cache)
+
+    return statistics
+
+
+def clear_poa_cache(clear_disk=False):
+    """
+    Empties the in-process cache and resets statistics
+    :param clear_disk: if True, files in config.POA_CACHE_DIRECTORY are removed as well
+    :return: None
+    """
+    __poa_cache.clear()
+    __daylight_windows.clear()
+    for name in __poa_cache_statistics:
+        __poa_cache_statistics[name] = 0
+
+    if clear_disk and config.POA_CACHE_DIRECTORY is not None and os.path.isdir(config.POA_CACHE_DIRECTORY):
+        for filename in os.listdir(config.POA_CACHE_DIRECTORY):
+            if filename.startswith("poa-") and filename.endswith(".npz"):
+                os.remove(os.path.join(config.POA_CACHE_DIRECTORY, filename))
+
+
+############################
+#   HELPERS BELOW, CALL ONLY FROM WITHIN THIS FILE
+############################
+
+def __simulate_irradiance(year, lat, lon, day, tilt, facing, use_cache=True, site=None):
+    """
+    Uncached transposition used by get_irradiance, the sky comes from cache if use_cache is True
+    """
+    sky = get_sky_for_day(year, lat, lon, day, use_cache=use_cache, site=site)
+
+    return get_irradiance_from_sky(sky, tilt, facing)
+
+
+def __simulate_sky(year, lat, lon, day, site=None):
+    """
+    Uncached simulation used by get_sky_for_day
+    """
+
+    # creating a pandas entity containing the times for which the irradiance is modeled for, using gmt
+    # as measurements are assumed to be in UTZ GMT time
+    return __simulate_sky_at_times(lat, lon, __get_day_times(year, day, 'GMT'), site)
+
+
+def __simulate_sky_at_times(lat, lon, times, site=None):
+    """
+    :param times: gmt pandas DatetimeIndex, whole minutes
+    :param site: site context of lat and lon, looked up from memory if None
+    :return: sky dataframe indexed by times
+    """
+
+    # site data required by pvlib poa, created once per site
+    if site is None:
+        site = get_site_context(lat, lon)
+
+    # creating a clear sky and solar position entities, clear sky reuses the solar position instead of computing it again
+    # and takes Linke turbidity from the site context instead of reading it from pvlib climatology file
+    solar_position = site.location.get_solarposition(times=times)
+    clearsky = site.location.get_clearsky(times, solar_position=solar_position,
+                                          linke_turbidity=get_linke_turbidity(site, times))
+
+    return pd.DataFrame(
+        {
+            "minute": numpy.asarray(times.hour * 60 + times.minute, dtype=numpy.int64),
+            "dni": clearsky["dni"],
+            "ghi": clearsky["ghi"],
+            "dhi": clearsky["dhi"],
+            "apparent_zenith": solar_position["apparent_zenith"],
+            "azimuth": solar_position["azimuth"]
+        },
+        index=times
+    )
+
+
+def __estimate_sun_event_minutes(latitudes, longitudes, days):
+    """
+    Approximate utc solar noon and half of day length from the NOAA equation of time and declination. Accurate to a
+    few minutes, which is enough for bracketing sunrise and sunset
+    :return: noon minutes from the start of the day 0 to 1440, half day lengths in minutes 0 to 720
+    """
+    fractional_year = 2 * numpy.pi / 365 * (days - 1 + 0.5)
+    equation_of_time = 229.18 * (0.000075 + 0.001868 * numpy.cos(fractional_year)
+                                 - 0.032077 * numpy.sin(fractional_year)
+                                 - 0.014615 * numpy.cos(2 * fractional_year)
+                                 - 0.040849 * numpy.sin(2 * fractional_year))
+    declination = (0.006918 - 0.399912 * numpy.cos(fractional_year) + 0.070257 * numpy.sin(fractional_year)
+                   - 0.006758 * numpy.cos(2 * fractional_year) + 0.000907 * numpy.sin(2 * fractional_year)
+                   - 0.002697 * numpy.cos(3 * fractional_year) + 0.00148 * numpy.sin(3 * fractional_year))
+
+    # hour angle of sunrise, 90.833 degrees accounts for refraction and the size of the solar disk
+    latitude_radians = numpy.radians(latitudes)
+    cos_hour_angle = (numpy.cos(numpy.radians(90.833)) / (numpy.cos(latitude_radians) * numpy.cos(declination))
+                      - numpy.tan(latitude_radians) * numpy.tan(declination))
+    hour_angle = numpy.degrees(numpy.arccos(numpy.clip(cos_hour_angle, -1, 1)))
+
+    return numpy.mod(720 - 4 * longitudes - equation_of_time, 1440), 4 * hour_angle
+
+
+def __get_day_start_seconds(years, days):
+    """
+    :return: float array of unix times of utc midnight at the start of every day
+    """
+    day_starts = numpy.asarray(years - 1970).astype("datetime64[Y]").astype("datetime64[D]") + (days - 1)
+
+    return day_starts.astype("datetime64[s]").astype(numpy.int64).astype(float)
+
+
+def __get_site_altitudes(latitudes, longitudes):
+    """
+    :return: altitudes which Location uses when altitude is not given, looked up once per unique site
+    """
+    sites, site_indexes = numpy.unique(numpy.stack([latitudes, longitudes], axis=1), axis=0, return_inverse=True)
+    site_altitudes = numpy.array([get_site_context(latitude, longitude).location.altitude
+                                  for latitude, longitude in sites])
+
+    return site_altitudes[site_indexes.ravel()]
+
+
+def __solve_sun_events(day_start_seconds, latitudes, longitudes, altitudes, noons, half_days):
+    """
+    Solves the sunrise before and the sunset after each noon
+    :param noons: approximate solar noons, minutes from the start of each day
+    :param half_days: approximate half day lengths in minutes
+    :return: first minutes after sunrise, nan if the sun doesn't rise, last minutes before sunset, nan if the sun
+    doesn't set, True where the sun is up at noon
+    """
+    window = 30
+
+    # noon, midnights and narrow brackets around estimated sunrises and sunsets evaluated in one call
+    minutes = numpy.stack([noons - 720, noons, noons + 720,
+                           numpy.maximum(noons - half_days - window, noons - 720),
+                           numpy.minimum(noons - half_days + window, noons),
+                           numpy.maximum(noons + half_days - window, noons),
+                           numpy.minimum(noons + half_days + window, noons + 720)])
+    elevations = __get_apparent_elevations(day_start_seconds, latitudes, longitudes, altitudes, minutes)
+
+    # sun has to be up at noon and down at the midnight before it for sunrise to exist, sunset is similar
+    noon_is_up = elevations[1] > 0
+    has_sunrise = noon_is_up & (elevations[0] <= 0)
+    has_sunset = noon_is_up & (elevations[2] <= 0)
+
+    # narrow brackets are used where they contain the crossing, otherwise the crossing is between noon and midnight
+    narrow_sunrise = (elevations[3] <= 0) & (elevations[4] > 0)
+    narrow_sunset = (elevations[5] > 0) & (elevations[6] <= 0)
+    lows = numpy.stack([numpy.where(narrow_sunrise, minutes[3], minutes[0]),
+                        numpy.where(narrow_sunset, minutes[5], minutes[1])])
+    highs = numpy.stack([numpy.where(narrow_sunrise, minutes[4], minutes[1]),
+                         numpy.where(narrow_sunset, minutes[6], minutes[2])])
+    low_elevations = numpy.stack([numpy.where(narrow_sunrise, elevations[3], elevations[0]),
+                                  numpy.where(narrow_sunset, elevations[5], elevations[1])])
+    high_elevations = numpy.stack([numpy.where(narrow_sunrise, elevations[4], elevations[1]),
+                                   numpy.where(narrow_sunset, elevations[6], elevations[2])])
+
+    sunrises_and_sunsets = __find_zero_elevation_minutes(day_start_seconds, latitudes, longitudes, altitudes, lows,
+                                                         highs, low_elevations, high_elevations)
+
+    # first whole minute after sunrise and last whole minute before sunset
+    first_minutes = numpy.where(has_sunrise, numpy.floor(sunrises_and_sunsets[0]) + 1, numpy.nan)
+    last_minutes = numpy.where(has_sunset, numpy.ceil(sunrises_and_sunsets[1]) - 1, numpy.nan)
+
+    return first_minutes, last_minutes, noon_is_up
+
+
+def __get_apparent_elevations(day_start_seconds, latitudes, longitudes, altitudes, minutes):
+    """
+    Apparent solar elevations with the same refraction, pressure and temperature as Location.get_solarposition uses
+    :param minutes: array of shape (..., sites), minutes from the start of each day
+    :return: array of elevations in degrees, same shape as minutes
+    """
+    unixtimes = day_start_seconds + minutes * 60
+    shape = unixtimes.shape
+
+    # delta t depends on the year and month of the evaluated moment
+    moments = unixtimes.ravel().astype("datetime64[s]")
+    moment_years = moments.astype("datetime64[Y]").astype(numpy.int64) + 1970
+    moment_months = moments.astype("datetime64[M]").astype(numpy.int64) % 12 + 1
+    delta_t = spa.calculate_deltat(moment_years, moment_months)
+
+    altitudes = numpy.broadcast_to(altitudes, shape).ravel()
+    pressures = atmosphere.alt2pres(altitudes) / 100
+    elevations = spa.solar_position(unixtimes.ravel(), numpy.broadcast_to(latitudes, shape).ravel(),
+                                    numpy.broadcast_to(longitudes, shape).ravel(), altitudes, pressures, 12, delta_t,
+                                    0.5667, 1)[2]
+
+    return elevations.reshape(shape)
+
+
+def __find_zero_elevation_minutes(day_start_seconds, latitudes, longitudes, altitudes, lows, highs, low_elevations,
+                                  high_elevations):
+    """
+    Illinois variant of regula falsi for the moment when apparent elevation crosses zero. Elevation is nearly linear
+    around sunrise and sunset, so a few iterations are usually enough. Elevation must be on different sides of zero at
+    lows and highs, otherwise the returned value is meaningless
+    :param lows: array of shape (..., sites), minutes
+    :param highs: array of the same shape
+    :param low_elevations: elevations at lows
+    :param high_elevations: elevations at highs
+    :return: array of crossing minutes, same shape as lows
+    """
+    a, b = numpy.array(lows, dtype=float), numpy.array(highs, dtype=float)
+    elevation_a, elevation_b = numpy.array(low_elevations, dtype=float), numpy.array(high_elevations, dtype=float)
+
+    for i in range(50):
+        denominator = elevation_b - elevation_a
+        c = numpy.where(denominator != 0, b - elevation_b * (b - a) / numpy.where(denominator != 0, denominator, 1),
+                        (a + b) / 2)
+        elevation_c = __get_apparent_elevations(day_start_seconds, latitudes, longitudes, altitudes, c)
+
+        # the crossing stays between a and b, halving the stale end point keeps convergence fast
+        crossing_between_b_and_c = numpy.sign(elevation_c) != numpy.sign(elevation_b)
+        a = numpy.where(crossing_between_b_and_c, b, a)
+        elevation_a = numpy.where(crossing_between_b_and_c, elevation_b, elevation_a / 2)
+
+        step = numpy.abs(c - b)
+        b, elevation_b = c, elevation_c
+
+        if numpy.all(step < config.SUN_EVENT_SOLVER_PRECISION_MINUTES):
+            break
+
+    return b
+
+
+def __get_panel_normals(tilts, facings):
+    """
+    :return: (N, 3) array of panel normal unit vectors, x towards north, y towards east and z towards zenith
+    """
+    tilts = numpy.radians(numpy.atleast_1d(numpy.asarray(tilts, dtype=float)))
+    facings = numpy.radians(numpy.atleast_1d(numpy.asarray(facings, dtype=float)))
+
+    if tilts.shape != facings.shape or tilts.ndim != 1:
+        raise ValueError("tilts and facings must be 1 dimensional arrays of the same length")
+
+    return numpy.stack([numpy.sin(tilts) * numpy.cos(facings), numpy.sin(tilts) * numpy.sin(facings), numpy.cos(tilts)],
+                       axis=1)
+
+
+def __create_site_context(lat, lon):
+    """
+    Reads site altitude and monthly Linke turbidities from pvlib climatology files, only called by get_site_context
+    """
+    site_location = location.Location(lat, lon, tz='GMT')
+
+    # turbidity at the first day of each month without interpolation is the stored monthly value
+    month_starts = pd.date_range(start="2015-01-01", periods=12, freq="MS", tz='GMT')
+    monthly_turbidities = clearsky.lookup_linke_turbidity(month_starts, lat, lon, interp_turbidity=False).values
+
+    # stored values are integers, turning them back to integers so that interpolation matches pvlib exactly
+    return SiteContext(lat, lon, site_location, numpy.round(monthly_turbidities * 20))
+
+
+def __get_month_middles(leap_year):
+    """
+    :return: middle days of months as used by pvlib turbidity interpolation, with previous december and next january
+    """
+    month_lengths = numpy.array(calendar.mdays[1:], dtype=float)
+    if leap_year:
+        month_lengths[1] += 1
+
+    return numpy.concatenate([[-calendar.mdays[12] / 2.0], numpy.cumsum(month_lengths) - month_lengths / 2.,
+                              [month_lengths.sum() + calendar.mdays[1] / 2.0]])
+
+
+def __get_day_times(year, day, tz):
+    """
+    :return: pandas DatetimeIndex of every minute in given day
+    """
+    date = datetime.strptime(str(year) + "-" + str(day), "%Y-%j").strftime("%m-%d-%Y")
+
+    return pd.date_range(date,  # year + day for which the irradiance is calculated
+                         freq='1min',  # take measurement every 1 minute
+                         periods=60 * 24,  # how many measurements, 60 * 24 for 60 times per 24 hours = 1440
+                         tz=tz)  # timezone, using gmt
+
+
+def __get_poa_cache_key(year, lat, lon, day, tilt, facing):
+    """
+    :return: tuple of rounded simulation arguments, nearly equal arguments share a key
+    """
+    coordinate_decimals = config.POA_CACHE_COORDINATE_DECIMALS
+    angle_decimals = config.POA_CACHE_ANGLE_DECIMALS
+
+    # adding 0.0 turns rounded negative zeros into zeros so that they share a key with zeros
+    return (int(year), round(float(lat), coordinate_decimals) + 0.0, round(float(lon), coordinate_decimals) + 0.0,
+            int(day), round(float(tilt), angle_decimals) + 0.0, round(float(facing), angle_decimals) + 0.0)
+
+
+def __get_cached_irradiance(key, site=None):
+    """
+    Returns a copy of the cached poa for key, simulates and caches it if not cached
+    """
+    if key in __poa_cache:
+        __poa_cache.move_to_end(key)
+        __poa_cache_statistics["hits"] += 1
+        return __poa_cache[key].copy()
+
+    poa = __read_poa_from_disk(key)
+    if poa is not None:
+        __poa_cache_statistics["disk_hits"] += 1
+    else:
+        __poa_cache_statistics["misses"] += 1
+        poa = __simulate_irradiance(*key, site=site)
+        __write_poa_to_disk(key, poa)
+
+    __store_in_memory(key, poa.copy())
+
+    return poa
+
+
+def __store_in_memory(key, dataframe):
+    __poa_cache[key] = dataframe
+    __poa_cache_statistics["bytes"] += int(dataframe.memory_usage(index=True).sum())
+
+    # dropping least recently used days until the cache fits, the newest day is always kept
+    while __poa_cache_statistics["bytes"] > config.POA_CACHE_MAX_BYTES and len(__poa_cache) > 1:
+        evicted_key, evicted_dataframe = __poa_cache.popitem(last=False)
+        __poa_cache_statistics["bytes"] -= int(evicted_dataframe.memory_usage(index=True).sum())
+        __poa_cache_statistics["evictions"] += 1
+
+
+def __get_poa_disk_path(key):
+    key_digest = hashlib.sha1(repr((POA_CACHE_FORMAT_VERSION,) + key).encode("utf-8")).hexdigest()[:20]
+
+    return os.path.join(config.POA_CACHE_DIRECTORY, "poa-" + key_digest + ".npz")
+
+
+def __read_poa_from_disk(key):
+    """
+    :return: poa dataframe from disk tier, None if disk tier is disabled or key is not stored
+    """
+    if config.POA_CACHE_DIRECTORY is None:
+        return None
+
+    disk_path = __get_poa_disk_path(key)
+    if not os.path.isfile(disk_path):
+        return None
+
+    with numpy.load(disk_path) as stored:
+        times = __get_day_times(key[0], key[3], 'GMT')
+        return pd.DataFrame({"minute": stored["minute"], "POA": stored["poa"]}, index=times)
+
+
+def __write_poa_to_disk(key, poa):
+    if config.POA_CACHE_DIRECTORY is None:
+        return
+
+    os.makedirs(config.POA_CACHE_DIRECTORY, exist_ok=True)
+
+    atomic_files.write_atomically(__get_poa_disk_path(key), lambda temporary_path: numpy.savez(
+        temporary_path, minute=poa["minute"].values, poa=poa["POA"].values))
@@ -1,32 +1,76 @@
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import time
+
+import numpy
 import pandas
 import xarray
 
+import atomic_files
+import config
+import day_quality
+import measurement_cube
+
+
+# column names of FMI Helsinki and Kuopio csv files
+FMI_CSV_COLUMNS = ["date", "output to grid", "power", "PV1", "PV2"]
+FMI_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 
 ############################
 #   FUNCTIONS FOR LOADING DATA
 #   USE FIRST 3 FUNCTIONS, HELSINKI AND KUOPIO FMI CONTAIN HIGH QUALITY DATA
+#   PASS chunks=config.LAZY_CHUNKS FOR A LAZILY EVALUATED, DASK BACKED XARRAY
 #   OTHER __FUNCTIONS ARE HELPERS, INTENDED FOR INTERNAL USE
 ############################
 
 
-def get_fmi_helsinki_data_as_xarray():
+def get_fmi_helsinki_data_as_xarray(use_cache=True, chunks=None):
     # filepath
     path = "fmi-helsinki-2021.csv"
-    return __load_csv_as_xa(path)
+    if chunks is not None:
+        return __load_fmi_lazily(path, chunks)
+    return __load_with_cache(path, __load_csv_as_xa, "fmi", use_cache)
 
 
-def get_fmi_kuopio_data_as_xarray():
+def get_fmi_kuopio_data_as_xarray(use_cache=True, chunks=None):
     # filepath
     path = "fmi-kuopio-2021.csv"
-    return __load_csv_as_xa(path)
+    if chunks is not None:
+        return __load_fmi_lazily(path, chunks)
+    return __load_with_cache(path, __load_csv_as_xa, "fmi", use_cache)
 
 
-def get_oomi_laanila_oulu():
+def get_oomi_laanila_oulu(use_cache=True, chunks=None):
     path = "laanilan-koulu-oulu-2022.csv"
-    data = __load_oomi_csv_as_xa(path)
+    data = __load_with_cache(path, __load_oomi_csv_as_xa, "oomi", use_cache)
+    if chunks is not None:
+        # 10 minute files are small, chunking the loaded xarray is enough
+        data = data.chunk(chunks)
     return data
 
 
+def __load_fmi_lazily(csv_filename, chunks):
+    """
+    Returns a lazily evaluated, dask backed xarray of an FMI csv. Measurements are kept in a measurement cube next to
+    the data cache and updated with update_cube_from_fmi_csv, so only new rows are parsed when the csv has grown.
+    Values are read from disk only for the chunks that are used, slicing a few days out of a long history does not
+    load the rest. Every day of every year is present and values are float32, missing minutes and days are nan
+    :param csv_filename: csv file following the FMI Helsinki and Kuopio pattern
+    :param chunks: dask chunk sizes per dimension, for example config.LAZY_CHUNKS
+    :return: xarray with year, day, minute coordinates and a lazy power data variable
+    """
+    cube_path = __get_cache_path(csv_filename, "fmi-cube")
+    update_cube_from_fmi_csv(csv_filename, cube_path)
+
+    cube, metadata = measurement_cube.open_cube(cube_path, mode="r")
+
+    return measurement_cube.cube_to_xarray(cube, metadata, chunks=chunks)
+
+
 def __load_oomi_csv_as_xa(csv_filename):
     """
     :param csv_filename: Name of csv file
@@ -39,12 +83,37 @@ def __load_oomi_csv_as_xa(csv_filename):
     Files following this structure will not be included in the project
     In this format, power measurements are given every 10 minutes and in KWh -format
     This function transforms KWh per 10 min to W per s 
+    
+    Footer rows containing averages are located and cut off here so that the fast C parser can be used, the python 
+    parser needed by skipfooter is many times slower. __load_oomi_csv_as_xa_python_engine gives identical output
     """
 
+    print("Loading oomidata from file " + str(csv_filename))
 
-    # expecting power to be in kwh over 10min, so 10 min to 60min = times 6
-    # kwh to wh = 1000
-    # 6000
+    with open(csv_filename, "rb") as csv_file:
+        content = csv_file.read()
+
+    # cutting off the footer block, everything after the last measurement row
+    content = content[:__find_oomi_footer_start(content)]
+
+    data = pandas.read_csv(
+        io.BytesIO(content),
+        sep=";",  # ; normal separator
+        skiprows=2,  # first 2 contain names
+        names=["date", "power", "empty"],  # "data;data;empty"
+        encoding='unicode_escape',  # removes an unicode decoder error
+        decimal=","  # seems to use 0,543 for power values
+    )
+
+    return __oomi_data_to_xa(data)
+
+
+def __load_oomi_csv_as_xa_python_engine(csv_filename):
+    """
+    Original OOMI loader, relies on the slow python parser for skipping the footer. Kept for reference and benchmarks
+    :param csv_filename: Name of csv file
+    :return: xarray containing power generation data
+    """
 
     print("Loading oomidata from file " + str(csv_filename))
     data = pandas.read_csv(
@@ -59,6 +128,19 @@ def __load_oomi_csv_as_xa(csv_filename):
         decimal=","  # seems to use 0,543 for power values
     )
 
+    return __oomi_data_to_xa(data)
+
+
+def __oomi_data_to_xa(data):
+    """
+    :param data: dataframe read from an OOMI csv file, power in kwh per 10 minutes
+    :return: xarray containing power generation data
+    """
+
+    # expecting power to be in kwh over 10min, so 10 min to 60min = times 6
+    # kwh to wh = 1000
+    # 6000
+
     # loading dates and converting to datetime
     dates = data["date"]
     data["date"] = pandas.to_datetime(dates)
@@ -81,6 +163,31 @@ def __load_oomi_csv_as_xa(csv_filename):
     return xa
 
 
+def __find_oomi_footer_start(content):
+    """
+    OOMI files end in a block of rows with averages and other summary data. Measurement rows begin with a date, so the
+    footer starts after the last row which begins with a digit. Only the end of the file is scanned
+    :param content: bytes of an OOMI csv file
+    :return: byte offset where the footer block begins, len(content) if there is no footer
+    """
+    footer_start = len(content)
+
+    # walking backwards one line at a time, trailing newline of the last line is skipped
+    line_end = len(content.rstrip(b"\r\n"))
+    while line_end > 0:
+        line_start = content.rfind(b"\n", 0, line_end) + 1
+        line = content[line_start:line_end].strip()
+
+        if line[:1].isdigit():
+            # measurement row found, footer begins on the next line
+            return footer_start
+
+        footer_start = line_start
+        line_end = line_start - 1
+
+    return footer_start
+
+
 def __load_csv_as_xa(csv_filename):
     """
     WARNING, THIS REQUIRES THE CSV FILE TO FOLLOW SAME PATTERN AS FMI HELSINKI AND FMI KUOPIO
@@ -103,24 +210,12 @@ def __load_csv_as_xa(csv_filename):
         csv_filename,
         sep=";",
         skiprows=16,
-        names=["date", "output to grid", "power", "PV1", "PV2"],
+        names=FMI_CSV_COLUMNS,
         nrows=10000000
     )
 
-    # dropping nan here might not be needed
-    data = data.dropna()
-
-    # modifying datetime field type to datetime.
-    data["date"] = pandas.to_datetime(data["date"])
-
-    # picking out the important fields of date and power from the dataframe
-    filtered_dataframe = pandas.DataFrame(data, columns=["date", "power"])
-
-    # changing format to our year, day minute, power -format. This splits the date to 3 fields
-    df_minutes = __minute_format(filtered_dataframe)
-
-    # naming the new 3 index columns
-    df_minutes = df_minutes.set_index(["year", "day", "minute"])
+    # changing format to year, day, minute -indexed power dataframe
+    df_minutes = __fmi_data_to_minute_df(data)
 
     # printing how much data came out
     print("Read " + str(len(df_minutes)) + " rows.")
@@ -143,135 +238,713 @@ def __load_csv_as_xa(csv_filename):
     return xa
 
 
+def stream_fmi_csv_to_cube(csv_filename, cube_path, chunk_rows=None):
+    """
+    Streaming alternative to __load_csv_as_xa for files which don't fit in memory. Reads an FMI format csv in chunks
+    of chunk_rows rows, gap fills each chunk and writes it to a measurement_cube at cube_path. There is no row cap and
+    peak memory depends only on chunk_rows, not on file length. Rows are expected in chronological order
+    :param csv_filename: csv file following the FMI Helsinki and Kuopio pattern
+    :param cube_path: path without file extension, existing cube is overwritten
+    :param chunk_rows: rows parsed at a time, defaults to config.STREAMING_CHUNK_ROWS
+    :return: cube(numpy memmap), metadata(dict). None, None if the file contained no valid measurements
+    """
+    if chunk_rows is None:
+        chunk_rows = config.STREAMING_CHUNK_ROWS
+
+    print("Streaming data from " + csv_filename + " to cube " + cube_path)
+
+    reader = pandas.read_csv(
+        csv_filename,
+        sep=";",
+        skiprows=16,
+        names=FMI_CSV_COLUMNS,
+        chunksize=chunk_rows
+    )
+
+    cube, metadata, rows_read, written_days = __write_fmi_chunks_to_cube(reader, cube_path, None, None, csv_filename)
+
+    if cube is None:
+        print("No valid measurements in " + csv_filename)
+        return None, None
+
+    print("Read " + str(rows_read) + " rows.")
+
+    # quality index of every day in the cube is stored next to it
+    quality_index = day_quality.compute_quality_index(measurement_cube.cube_to_xarray(cube, metadata))
+    day_quality.write_quality_index(cube_path + ".quality.npz", quality_index)
+
+    return cube, metadata
+
+
+def update_cube_from_fmi_csv(csv_filename, cube_path, chunk_rows=None):
+    """
+    Incremental version of stream_fmi_csv_to_cube for files which grow over time. The cube metadata remembers the byte
+    offset where the last stored day begins in the csv. Only rows from that offset onwards are parsed, so the cost of
+    a daily update depends on the amount of new data, not on the size of the archive. The last stored day is always
+    parsed again as it may have been incomplete during the previous update. If the cube doesn't exist or the file no
+    longer matches the stored offset, the whole file is streamed again
+    :param csv_filename: csv file following the FMI Helsinki and Kuopio pattern
+    :param cube_path: path without file extension
+    :param chunk_rows: rows parsed at a time, defaults to config.STREAMING_CHUNK_ROWS
+    :return: cube(numpy memmap), metadata(dict). None, None if the file contained no valid measurements
+    """
+    if chunk_rows is None:
+        chunk_rows = config.STREAMING_CHUNK_ROWS
+
+    if not __cube_matches_csv_tail(csv_filename, cube_path):
+        cube, metadata = stream_fmi_csv_to_cube(csv_filename, cube_path, chunk_rows)
+        if cube is None:
+            return None, None
+        return cube, __store_csv_tail_position(csv_filename, cube_path, metadata)
+
+    cube, metadata = measurement_cube.open_cube(cube_path, mode="r+")
+    offset = metadata["source_offset"]
+
+    print("Appending data from " + csv_filename + " to cube " + cube_path + ", starting from byte " + str(offset))
+
+    with open(csv_filename, "rb") as csv_file:
+        csv_file.seek(offset)
+        reader = pandas.read_csv(
+            csv_file,
+            sep=";",
+            names=FMI_CSV_COLUMNS,
+            chunksize=chunk_rows
+        )
+        cube, metadata, rows_read, written_days = __write_fmi_chunks_to_cube(reader, cube_path, cube, metadata,
+                                                                             csv_filename)
+
+    print("Read " + str(rows_read) + " new rows.")
+
+    __update_cube_quality_index(cube_path, cube, metadata, written_days)
+
+    return cube, __store_csv_tail_position(csv_filename, cube_path, metadata)
+
+
+def __write_fmi_chunks_to_cube(reader, cube_path, cube, metadata, source):
+    """
+    Writes chunks from a pandas csv reader to cube. Days are always written whole, the last day of every chunk is held
+    back until the next chunk has been read
+    :param reader: iterable of dataframes with FMI_CSV_COLUMNS
+    :param cube_path: path without file extension
+    :param cube: open writable cube, or None if a new cube should be created
+    :param metadata: cube metadata or None
+    :param source: source file name stored in cube metadata
+    :return: cube, metadata, amount of csv rows read, set of written (year, day) pairs
+    """
+    rows_read = 0
+    written_days = set()
+
+    # rows of the last day in previous chunk, the next chunk may contain more minutes of the same day
+    held_back_day = None
+
+    for data in reader:
+        rows_read += len(data)
+
+        df_minutes = __fmi_data_to_minute_df(data)
+        df_minutes = df_minutes.where(df_minutes.power > 0)
+        df_minutes = df_minutes.dropna(how="any")
+
+        if held_back_day is not None:
+            df_minutes = pandas.concat([held_back_day, df_minutes])
+
+        if len(df_minutes) == 0:
+            continue
+
+        # splitting the last day off, it is written once the next chunk has been read
+        years = df_minutes.index.get_level_values("year").values
+        days = df_minutes.index.get_level_values("day").values
+        in_last_day = (years == years[-1]) & (days == days[-1])
+
+        held_back_day = df_minutes[in_last_day]
+        written_days.update(zip(years[~in_last_day], days[~in_last_day]))
+        cube, metadata = __write_minute_df_to_cube(df_minutes[~in_last_day], cube_path, cube, metadata, source)
+
+        print("\tStreamed " + str(rows_read) + " rows")
+
+    if held_back_day is not None and len(held_back_day) > 0:
+        written_days.add(held_back_day.index[0][:2])
+        cube, metadata = __write_minute_df_to_cube(held_back_day, cube_path, cube, metadata, source)
+
+    if cube is not None:
+        cube.flush()
+
+    return cube, metadata, rows_read, written_days
+
+
+def __update_cube_quality_index(cube_path, cube, metadata, written_days):
+    """
+    Recomputes quality statistics for written days only and stores them in cube_path.quality.npz
+    :param written_days: set of (year, day) pairs
+    """
+    quality_path = cube_path + ".quality.npz"
+
+    if not os.path.isfile(quality_path):
+        quality_index = day_quality.compute_quality_index(measurement_cube.cube_to_xarray(cube, metadata))
+        day_quality.write_quality_index(quality_path, quality_index)
+        return
+
+    # cube may have gained years since the quality index was written
+    quality_index = day_quality.read_quality_index(quality_path).reindex(
+        year=measurement_cube.get_years(metadata),
+        day=numpy.arange(1, metadata["days"] + 1),
+        fill_value=day_quality.EMPTY_DAY_STATISTICS
+    )
+
+    if len(written_days) > 0:
+        years, days = numpy.array(sorted(written_days)).T
+        year_indexes = years - metadata["first_year"]
+        statistics = day_quality.compute_day_statistics(cube[year_indexes, days - 1])
+        for name in day_quality.QUALITY_VARIABLES:
+            quality_index[name].values[year_indexes, days - 1] = statistics[name]
+
+    day_quality.write_quality_index(quality_path, quality_index)
+
+
+def __cube_matches_csv_tail(csv_filename, cube_path):
+    """
+    :return: True if cube_path has been built from csv_filename and the csv still has the same line at the stored offset
+    """
+    if not measurement_cube.cube_exists(cube_path):
+        return False
+
+    metadata = measurement_cube.read_metadata(cube_path)
+
+    if "source_offset" not in metadata or metadata.get("source") != os.path.abspath(csv_filename):
+        return False
+
+    # growing files only get longer, shorter file has been rewritten
+    if os.path.getsize(csv_filename) < metadata["source_size"]:
+        return False
+
+    return __read_line_at(csv_filename, metadata["source_offset"]) == metadata["source_offset_line"]
+
+
+def __store_csv_tail_position(csv_filename, cube_path, metadata):
+    """
+    Stores the offset of the last day in csv_filename to cube metadata
+    :return: updated metadata
+    """
+    offset = __find_last_day_offset(csv_filename)
+
+    metadata = dict(metadata)
+    metadata["source"] = os.path.abspath(csv_filename)
+    metadata["source_size"] = os.path.getsize(csv_filename)
+    metadata["source_offset"] = offset
+    metadata["source_offset_line"] = __read_line_at(csv_filename, offset)
+    measurement_cube.write_metadata(cube_path, metadata)
+
+    return metadata
+
+
+def __find_last_day_offset(csv_filename):
+    """
+    Finds the byte offset of the first row of the last day in an FMI csv. Rows begin with a YYYY-MM-DD date, so the
+    file is read backwards in blocks until a row with a different date is found
+    :return: byte offset of the first row of the last day
+    """
+    block_size = 1024 * 1024
+
+    with open(csv_filename, "rb") as csv_file:
+        csv_file.seek(0, os.SEEK_END)
+        position = csv_file.tell()
+        content = b""
+
+        while True:
+            block_start = max(0, position - block_size)
+            csv_file.seek(block_start)
+            content = csv_file.read(position - block_start) + content
+            position = block_start
+
+            lines = content.rstrip(b"\r\n").split(b"\n")
+            last_date = lines[-1][:10]
+
+            # the first line of content may be cut in half unless the start of file has been reached
+            first_complete_line = 0 if position == 0 else 1
+
+            for i in range(len(lines) - 1, first_complete_line - 1, -1):
+                if lines[i][:10] != last_date:
+                    # line i belongs to an earlier day or to the header, last day begins after it
+                    return position + sum(len(line) + 1 for line in lines[:i + 1])
+
+            if position == 0:
+                return 0
+
+
+def __read_line_at(filename, offset):
+    """
+    :return: line starting at byte offset as a string, without line break
+    """
+    with open(filename, "rb") as file:
+        file.seek(offset)
+        return file.readline().rstrip(b"\r\n").decode("utf-8", errors="replace")
+
+
+def __fmi_data_to_minute_df(data):
+    """
+    :param data: dataframe read from an FMI format csv with FMI_CSV_COLUMNS
+    :return: year - day - minute -indexed power dataframe
+    """
+    # dropping nan here might not be needed
+    data = data.dropna()
+
+    # modifying datetime field type to datetime, explicit format avoids per row format inference
+    data["date"] = pandas.to_datetime(data["date"], format=FMI_DATE_FORMAT)
+
+    # picking out the important fields of date and power from the dataframe
+    filtered_dataframe = pandas.DataFrame(data, columns=["date", "power"])
+
+    # changing format to our year, day minute, power -format. This splits the date to 3 fields
+    df_minutes = __minute_format(filtered_dataframe)
+
+    # naming the new 3 index columns
+    return df_minutes.set_index(["year", "day", "minute"])
+
+
+def __write_minute_df_to_cube(df_minutes, cube_path, cube, metadata, source):
+    """
+    Gap fills df_minutes and writes it to cube, creating or extending the cube when needed
+    :param df_minutes: year - day - minute -indexed power dataframe containing only whole days
+    :param cube_path: path without file extension
+    :param cube: cube or None if it has not been created yet
+    :param metadata: cube metadata or None
+    :param source: source file name stored in cube metadata
+    :return: cube, metadata
+    """
+    if len(df_minutes) == 0:
+        return cube, metadata
+
+    df_minutes = __fill_missing_values_df(df_minutes)
+    df_minutes = df_minutes.dropna()
+
+    years = df_minutes.index.get_level_values("year").values
+
+    days = df_minutes.index.get_level_values("day").values
+
+    if cube is None:
+        cube, metadata = measurement_cube.create_cube(cube_path, years.min(), years.max(), source)
+    else:
+        cube, metadata = measurement_cube.extend_cube_years(cube_path, cube, metadata, years.min(), years.max())
+
+    # days are written whole, clearing them first removes minutes stored by earlier incomplete writes
+    measurement_cube.clear_days(cube, metadata, years, days)
+    measurement_cube.write_values(cube, metadata, years, days, df_minutes.index.get_level_values("minute").values,
+                                  df_minutes["power"].values)
+
+    return cube, metadata
+
+
 def __fill_missing_values_df(df):
     print("\tFilling missing values in df")
 
     '''
-    This function is not especially pretty. 
-    Dicts are used to iterate through the data and missing minutes are linearly approximated
+    Missing minutes are linearly approximated for every day in one pass. Each day is extended to cover every minute
+    from its first to its last measured minute, after which the whole frame is interpolated with numpy.interp.
+    As every day both begins and ends with a measured value, interpolation never crosses day boundaries.
     '''
 
-    # creating a dict where year maps to a list of days for that year in dataset
-    # should contain 2016 to [1, 2,3,3,4, ... 365], 2017 to [1,2...]
-    year_to_day_list_dict = dict()
-
-    # filling the year to day list dict
-    for index_tuple in df.index.values:
-        year = index_tuple[0]
-        day = index_tuple[1]
-        if year in year_to_day_list_dict:
-            day_list = year_to_day_list_dict.get(year)
-            if day_list[len(day_list) - 1] != day:
-                day_list.append(day)
-                year_to_day_list_dict[year] = day_list
-        else:
-            year_to_day_list_dict[year] = [day]
-
-
-    full_set_of_years = []
-
-    # iterating through the dict where key = year, value = days of that year
-    for key in year_to_day_list_dict.keys():
-
-        # using the year key to slice the dataframe so that we get only that specific year
-        df_of_year = df.xs(key, level=0)
-
-        # list of every single day corresponding to this specific year
-        year_days = year_to_day_list_dict[key]
-
-        # list days without missing minutes from this key year
-        days_without_missing_minutes = []
-
-        # Looping through each day in year_days
-        for day in year_days:
-            # slicing the specific day from year long dataframe
-            day = df_of_year.xs(day, level=0)
-            # filling missing minutes from the day
-            day_without_missing_minutes = __fill_missing_minute_values_within_given_day(day)
-            # adding the day without missing minutes to a list of multiple days without missing minutes
-            days_without_missing_minutes.append(day_without_missing_minutes)
-
-        # merging the lists of days together to create a full year
-        year_df = pandas.concat(days_without_missing_minutes, keys=year_days, names=["day", "minute"])
-        # adding this year_df containing days without missing minutes to a list of processed years
-        full_set_of_years.append(year_df)
-
-    # merging processed years together, this final df should not be missing any minutes
-    output_df = pandas.concat(full_set_of_years, keys=year_to_day_list_dict.keys(), names=["year", "day", "minute"])
+    if len(df) == 0:
+        return df
+
+    # sorting and dropping duplicate index tuples, the grid below assumes unique and ordered (year, day, minute)
+    df = df[~df.index.duplicated()].sort_index()
+
+    years = df.index.get_level_values("year").values.astype(numpy.int64)
+    days = df.index.get_level_values("day").values.astype(numpy.int64)
+    minutes = df.index.get_level_values("minute").values.astype(numpy.int64)
+    powers = df["power"].values.astype(float)
+
+    # finding the first row of every (year, day) block
+    day_starts_mask = numpy.ones(len(df), dtype=bool)
+    day_starts_mask[1:] = (years[1:] != years[:-1]) | (days[1:] != days[:-1])
+    day_starts = numpy.flatnonzero(day_starts_mask)
+    day_ends = numpy.append(day_starts[1:], len(df)) - 1
+
+    # each day is filled from its first measured minute to its last measured minute
+    first_minutes = minutes[day_starts]
+    last_minutes = minutes[day_ends]
+    day_lengths = last_minutes - first_minutes + 1
+    rows_per_day = day_ends - day_starts + 1
+
+    # offsets of each day in the filled grid
+    grid_day_offsets = numpy.cumsum(day_lengths) - day_lengths
+    grid_size = int(day_lengths.sum())
+
+    # year, day and minute values of the filled grid
+    grid_years = numpy.repeat(years[day_starts], day_lengths)
+    grid_days = numpy.repeat(days[day_starts], day_lengths)
+    grid_minutes = numpy.repeat(first_minutes, day_lengths) + numpy.arange(grid_size) - numpy.repeat(grid_day_offsets,
+                                                                                                     day_lengths)
+
+    # positions of the measured values in the filled grid
+    measured_positions = numpy.repeat(grid_day_offsets, rows_per_day) + minutes - numpy.repeat(first_minutes,
+                                                                                               rows_per_day)
+
+    # INTERPOLATION HAPPENS HERE, measured values are kept as is and gaps are filled linearly
+    grid_powers = numpy.interp(numpy.arange(grid_size), measured_positions, powers)
+
+    output_index = pandas.MultiIndex.from_arrays([grid_years, grid_days, grid_minutes],
+                                                 names=["year", "day", "minute"])
+    output_df = pandas.DataFrame({"power": grid_powers}, index=output_index)
+
     print("\tMissed values are now filled")
     return output_df
 
 
-def __fill_missing_minute_values_within_given_day(day):
+def __minute_format(dataframe):
     """
-    Linear interpolation of missing minutes method
-    :param day: pandas dataframe containing one day of data
-    :return:
+    :param dataframe: datetime - power dataframe
+    :return: year - day - minute - power dataframe
     """
+    print("*Reformatting dataframe to [Year, Day, Minute, Power] -format")
+
+    # year, day and minute are computed directly from datetime64 values, string formatting is slow on large files
+    # converting to minute resolution first drops seconds, same as using dt.hour * 60 + dt.minute
+    dates_in_minutes = dataframe["date"].values.astype("datetime64[m]")
+    dates_in_days = dates_in_minutes.astype("datetime64[D]")
+    dates_in_years = dates_in_days.astype("datetime64[Y]")
+
+    # dtypes match the dt accessor results, year and minute int32, day int64
+    output = pandas.DataFrame(
+        {
+            "year": (dates_in_years.astype(numpy.int64) + 1970).astype(numpy.int32),
+            "day": (dates_in_days - dates_in_years.astype("datetime64[D]")).astype(numpy.int64) + 1,
+            "minute": (dates_in_minutes - dates_in_days.astype("datetime64[m]")).astype(numpy.int32),
+            "power": dataframe["power"].values
+        },
+        index=dataframe.index
+    )
+
+    return output
 
+
+############################
+#   FUNCTIONS FOR LOADING MANY INSTALLATIONS AT ONCE
+#   FILES ARE PARSED AND GAP FILLED IN A PROCESS POOL, ONE FILE PER TASK
+############################
+
+
+def load_csv_files_in_parallel(files, data_format="fmi", processes=None, output_directory=None, use_cache=True):
+    """
+    Loads one dataset per installation csv file using a pool of worker processes. A file which fails to load does not
+    stop the others, its error message is returned instead
+    :param files: directory of .csv files, manifest text file listing one csv path per line, or a list of csv paths
+    :param data_format: "fmi" for FMI Helsinki and Kuopio style files, "oomi" for OOMI 10 minute files
+    :param processes: worker process count, defaults to os.cpu_count()
+    :param output_directory: if given, each dataset is written as a measurement cube to output_directory/<site> and
+    cube paths are returned instead of xarrays
+    :param use_cache: workers read and write the data cache like the single file loaders
+    :return: datasets(dict site -> xarray or cube path), failures(dict site -> error message), report(dict)
     """
-        Dataframe structure:
-                power
-        minute       
-        296      14.0
-        297      15.0
-        298      25.0
-        299      42.4
-        300      40.1
+    # failing early on bad format tags instead of once per file
+    __get_loader_function(data_format)
+
+    csv_filenames = __list_csv_files(files)
+    sites = __csv_filenames_to_site_names(csv_filenames)
+
+    print("Loading " + str(len(csv_filenames)) + " " + data_format + " files")
+    start_time = time.time()
+
+    datasets = dict()
+    failures = dict()
+    rows = 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = dict()
+        for site, csv_filename in zip(sites, csv_filenames):
+            future = executor.submit(__load_site, site, csv_filename, data_format, output_directory, use_cache)
+            futures[future] = site
+
+        for future in concurrent.futures.as_completed(futures):
+            site = futures[future]
+            try:
+                dataset, site_rows = future.result()
+            except Exception as error:
+                # errors raised inside workers and crashed workers both end up here
+                failures[site] = type(error).__name__ + ": " + str(error)
+                print("\tFailed to load " + site + ", " + failures[site])
+                continue
+
+            datasets[site] = dataset
+            rows += site_rows
+            print("\tLoaded " + site)
+
+    elapsed = time.time() - start_time
+
+    # throughput is reported for successfully loaded files only
+    loaded_filenames = [csv_filename for site, csv_filename in zip(sites, csv_filenames) if site in datasets]
+    megabytes = sum(os.path.getsize(csv_filename) for csv_filename in loaded_filenames) / (1024 * 1024)
+
+    report = {
+        "files": len(csv_filenames),
+        "loaded": len(datasets),
+        "failed": len(failures),
+        "rows": rows,
+        "megabytes": megabytes,
+        "seconds": elapsed,
+        "files_per_second": len(datasets) / elapsed,
+        "rows_per_second": rows / elapsed,
+        "megabytes_per_second": megabytes / elapsed
+    }
+
+    print("Loaded " + str(len(datasets)) + " of " + str(len(csv_filenames)) + " files in " + str(round(elapsed, 2))
+          + " s, " + str(round(report["files_per_second"], 2)) + " files/s, "
+          + str(round(report["megabytes_per_second"], 2)) + " MB/s, "
+          + str(round(report["rows_per_second"])) + " measurements/s")
+    if len(failures) > 0:
+        print(str(len(failures)) + " files failed to load: " + ", ".join(sorted(failures)))
+
+    return datasets, failures, report
+
+
+def __load_site(site, csv_filename, data_format, output_directory, use_cache):
     """
+    Worker function for load_csv_files_in_parallel
+    :return: xarray or cube path, amount of non-nan power values in dataset
+    """
+    xa = __load_with_cache(csv_filename, __get_loader_function(data_format), data_format, use_cache)
+    rows = int(xa["power"].count())
+
+    if rows == 0:
+        raise ValueError("No valid measurements in " + csv_filename)
 
-    first_minute = min(day.index)
-    last_minute = max(day.index)
+    if output_directory is None:
+        return xa, rows
 
-    missing_minutes = []
-    missing_values = []
+    cube_path = os.path.join(output_directory, site)
+    measurement_cube.write_cube_from_xarray(xa, cube_path, source=os.path.abspath(csv_filename))
 
-    # determines if trailing or leading values should be added
-    fill_before_after = False
+    return cube_path, rows
 
-    for i in range(1440):
-        if fill_before_after:
-            if i < first_minute or i > last_minute:
-                missing_minutes.append(i)
-                missing_values.append(0)
-            elif i not in day.index:
-                missing_minutes.append(i)
-                missing_values.append(float("nan"))
-        else:
-            if first_minute <= i <= last_minute and i not in day.index:
-                missing_minutes.append(i)
-                missing_values.append(float("nan"))
 
-    missing_dict = {"minute": missing_minutes, "power": missing_values}
-    df_missing_values = pandas.DataFrame.from_dict(missing_dict)
-    df_missing_values = df_missing_values.set_index("minute")
-    full1440day = pandas.concat([day, df_missing_values])
-    full1440day = full1440day.sort_index()
+def __get_loader_function(data_format):
+    if data_format == "fmi":
+        return __load_csv_as_xa
+    if data_format == "oomi":
+        return __load_oomi_csv_as_xa
+    raise ValueError("Unknown data format " + str(data_format) + ", use \"fmi\" or \"oomi\"")
 
-    # INTERPOLATION HAPPENS HERE, interpolation is done twice, once from both different directions as the interpolation
-    # method does not seem to be direction invariant. Using two interpolations seemed to fix the is
-    full1440day = full1440day.interpolate(method="linear")
-    full1440day = full1440day.reindex(index=full1440day.index[::-1])
-    full1440day = full1440day.interpolate(method="linear")
-    full1440day = full1440day.reindex(index=full1440day.index[::-1])
 
-    return full1440day
+def __list_csv_files(files):
+    """
+    :param files: directory, manifest file or list of paths
+    :return: list of csv paths. Relative paths in manifest files are relative to the manifest
+    """
+    if not isinstance(files, str):
+        return list(files)
 
+    if os.path.isdir(files):
+        filenames = sorted(filename for filename in os.listdir(files) if filename.lower().endswith(".csv"))
+        return [os.path.join(files, filename) for filename in filenames]
 
-def __minute_format(dataframe):
+    manifest_directory = os.path.dirname(files)
+    csv_filenames = []
+    with open(files, "r") as manifest:
+        for line in manifest:
+            line = line.strip()
+            # skipping empty lines and comments
+            if line == "" or line.startswith("#"):
+                continue
+            csv_filenames.append(os.path.join(manifest_directory, line))
+
+    return csv_filenames
+
+
+def __csv_filenames_to_site_names(csv_filenames):
     """
-    :param dataframe: datetime - power dataframe
-    :return: year - day - minute - power dataframe
+    :return: list of site names, file names without extension
     """
-    print("*Reformatting dataframe to [Year, Day, Minute, Power] -format")
+    sites = [os.path.splitext(os.path.basename(csv_filename))[0] for csv_filename in csv_filenames]
+
+    if len(set(sites)) != len(sites):
+        raise ValueError("Csv file names must be unique, site names are taken from file names")
+
+    return sites
+
+
+############################
+#   FUNCTIONS FOR CACHING LOADED DATA
+#   LOADED XARRAYS ARE STORED IN config.DATA_CACHE_DIRECTORY AS .npz FILES WITH A .json METADATA SIDECAR
+#   CACHE FILES ARE INVALIDATED WHEN SOURCE FILE SIZE, MODIFICATION TIME OR CONTENT CHANGES
+#   A PER-DAY QUALITY INDEX, SEE day_quality.py, IS STORED NEXT TO EVERY CACHED XARRAY AS .quality.npz
+############################
+
+# increment when the structure of loaded xarrays changes, old cache files are then ignored
+CACHE_FORMAT_VERSION = 2
+CACHE_FILE_EXTENSIONS = (".npz", ".json", ".cube")  # npz caches, quality indexes, lazy loading cubes and metadata
+
+
+def clear_cache():
+    """
+    Removes every cache file from config.DATA_CACHE_DIRECTORY, including cubes of lazy loading and temporary files
+    left behind by interrupted writes
+    :return: None
+    """
+    if not os.path.isdir(config.DATA_CACHE_DIRECTORY):
+        return
+
+    for filename in os.listdir(config.DATA_CACHE_DIRECTORY):
+        if filename.endswith(CACHE_FILE_EXTENSIONS) or atomic_files.is_temporary_file(filename):
+            os.remove(os.path.join(config.DATA_CACHE_DIRECTORY, filename))
+
+
+def get_quality_index(csv_filename, data_format="fmi", lazy=False):
+    """
+    Returns the per-day quality index of csv_filename without loading measurements when the file has already been
+    cached. Estimators can use it to skip days which would be rejected anyway, see day_quality.select_days
+    :param csv_filename: path to source csv file
+    :param data_format: "fmi" or "oomi"
+    :param lazy: if True, the index of the memory-mapped cube used by lazy loading is returned. FMI files only
+    :return: quality index xarray with year, day coordinates
+    """
+    if lazy:
+        if data_format != "fmi":
+            raise ValueError("Lazy loading is only supported for fmi files, not " + data_format)
+        cube_path = __get_cache_path(csv_filename, "fmi-cube")
+        update_cube_from_fmi_csv(csv_filename, cube_path)
+        return day_quality.read_quality_index(cube_path + ".quality.npz")
 
-    output = pandas.DataFrame.copy(dataframe, deep=True)
+    cache_path = __get_cache_path(csv_filename, data_format)
+    xa = __load_with_cache(csv_filename, __get_loader_function(data_format), data_format, True)
 
-    output["minute"] = output["date"].dt.hour * 60 + output["date"].dt.minute
+    # files without valid measurements are not cached
+    if not os.path.isfile(cache_path + ".quality.npz"):
+        return day_quality.compute_quality_index(xa)
+
+    return day_quality.read_quality_index(cache_path + ".quality.npz")
+
+
+def __load_with_cache(csv_filename, loader_function, loader_tag, use_cache):
+    """
+    Returns cached xarray for csv_filename if the cache is still valid, otherwise loads the file with loader_function
+    and writes the result to cache
+    :param csv_filename: path to source csv file
+    :param loader_function: function which takes csv_filename and returns an xarray
+    :param loader_tag: name of the file format, "fmi" or "oomi". Same file loaded as different formats is cached twice
+    :param use_cache: if False, cache is neither read nor written
+    :return: xarray containing power generation data
+    """
+    if not use_cache:
+        return loader_function(csv_filename)
+
+    cache_path = __get_cache_path(csv_filename, loader_tag)
+    source_stat = os.stat(csv_filename)
+
+    if __cache_is_valid(cache_path, csv_filename, loader_tag, source_stat):
+        print("Loading cached data for " + csv_filename)
+        return __read_cached_xa(cache_path)
+
+    xa = loader_function(csv_filename)
+
+    # empty datasets have object dtype coordinates which can't be stored without pickling, they are cheap to reload
+    if xa["power"].size > 0:
+        __write_cached_xa(cache_path, xa, csv_filename, loader_tag, source_stat)
+
+    return xa
+
+
+def __get_cache_path(csv_filename, loader_tag):
+    """
+    :param csv_filename: path to source csv file
+    :param loader_tag: name of the file format
+    :return: cache path without file extension, unique for each absolute source path and loader tag
+    """
+    absolute_path = os.path.abspath(csv_filename)
+    path_digest = hashlib.sha1((absolute_path + ";" + loader_tag).encode("utf-8")).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(csv_filename))[0]
 
-    output["year"] = output["date"].dt.year
-    output["day"] = output["date"].dt.strftime("%j").astype(int)
+    return os.path.join(config.DATA_CACHE_DIRECTORY, stem + "-" + loader_tag + "-" + path_digest)
 
-    output2 = pandas.DataFrame(output, columns=["year", "day", "minute", "power"])
 
-    return output2
\ No newline at end of file
+def __cache_is_valid(cache_path, csv_filename, loader_tag, source_stat):
+    """
+    Checks cache metadata against the source file. Size and modification time are compared first. If only the
+    modification time differs, content hash decides and metadata is refreshed so that the hash is not computed again
+    :return: True if cached xarray can be used
+    """
+    for extension in [".npz", ".json", ".quality.npz"]:
+        if not os.path.isfile(cache_path + extension):
+            return False
+
+    with open(cache_path + ".json", "r") as metadata_file:
+        metadata = json.load(metadata_file)
+
+    if metadata.get("version") != CACHE_FORMAT_VERSION or metadata.get("loader") != loader_tag:
+        return False
+
+    if metadata.get("source") != os.path.abspath(csv_filename) or metadata.get("size") != source_stat.st_size:
+        return False
+
+    if metadata.get("mtime_ns") == source_stat.st_mtime_ns:
+        return True
+
+    # file was touched or copied, content hash decides
+    if metadata.get("sha256") != __get_file_hash(csv_filename):
+        return False
+
+    metadata["mtime_ns"] = source_stat.st_mtime_ns
+    __write_json_atomically(cache_path + ".json", metadata)
+
+    return True
+
+
+def __read_cached_xa(cache_path):
+    """
+    :param cache_path: cache path without file extension
+    :return: xarray with the same structure as the xarrays returned by the csv loaders
+    """
+    with numpy.load(cache_path + ".npz") as cached:
+        xa = xarray.Dataset(
+            {"power": (("year", "day", "minute"), cached["power"])},
+            coords={"year": cached["year"], "day": cached["day"], "minute": cached["minute"]}
+        )
+
+    return xa
+
+
+def __write_cached_xa(cache_path, xa, csv_filename, loader_tag, source_stat):
+    """
+    Writes xa to cache_path.npz, its quality index to cache_path.quality.npz and source file metadata to
+    cache_path.json
+    """
+    os.makedirs(config.DATA_CACHE_DIRECTORY, exist_ok=True)
+
+    power = xa["power"].transpose("year", "day", "minute")
+
+    atomic_files.write_atomically(cache_path + ".npz", lambda temporary_path: numpy.savez_compressed(
+        temporary_path, power=power.values, year=power["year"].values, day=power["day"].values,
+        minute=power["minute"].values))
+
+    day_quality.write_quality_index(cache_path + ".quality.npz", day_quality.compute_quality_index(xa))
+
+    metadata = {
+        "version": CACHE_FORMAT_VERSION,
+        "loader": loader_tag,
+        "source": os.path.abspath(csv_filename),
+        "size": source_stat.st_size,
+        "mtime_ns": source_stat.st_mtime_ns,
+        "sha256": __get_file_hash(csv_filename)
+    }
+    __write_json_atomically(cache_path + ".json", metadata)
+
+    print("Cached data to " + cache_path + ".npz")
+
+
+def __write_json_atomically(path, content):
+    def write_json(temporary_path):
+        with open(temporary_path, "w") as json_file:
+            json.dump(content, json_file)
+
+    atomic_files.write_atomically(path, write_json)
+
+
+def __get_file_hash(filename):
+    """
+    :param filename: path to file
+    :return: sha256 hex digest of file content, file is read in 1MB blocks
+    """
+    file_hash = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
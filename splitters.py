@@ -1,10 +1,19 @@
+import collections
+import concurrent.futures
+
+import numpy
+
+import config
+import day_quality
+
+
 ############################
 #   FUNCTIONS FOR SPLITTING DATAFRAMES
 ############################
 
 def slice_xa(xa, year_first, year_last, day_first, day_last):
     """
-    THIS MALFUNCTIONS WITH MULTI YEAR DATAFRAMES
+    THIS MALFUNCTIONS WITH MULTI YEAR DATAFRAMES, USE build_day_index AND get_day_range FOR RANGES OVER YEAR BOUNDARIES
     """
     correct_year = xa.sel(year=slice(year_first, year_last))
     correct_year_correct_day = correct_year.sel(day=slice(day_first, day_last))
@@ -46,29 +55,222 @@ def get_xa_values_within_percentage_of_max_interval(xa_day, low, high):
 
 def split_xa_to_3_lists(xa):
     """
-    :param xa:
-    :return: days, minutes, powers as 3 lists
+    Days of later years are offset by 365 days per year after the first year with measurements
+    :param xa: xarray with power data variable and year, day, minute coordinates
+    :return: days, minutes, powers as 3 numpy arrays of the non-nan measurements, ordered by year, day and minute
     """
+    power = xa["power"].transpose("year", "day", "minute").sortby(["year", "day", "minute"])
+    values = power.values
 
-    days = []
-    minutes = []
-    powers = []
-
-    xa_df = xa.to_dataframe()
+    # nonzero walks the cube in year, day, minute order
+    year_indexes, day_indexes, minute_indexes = numpy.nonzero(~numpy.isnan(values))
 
-    # print("xa_df size:" + str(len(xa_df)))
-    # print("after dropna: " + str(len(xa_df.dropna())))
+    years = power["year"].values[year_indexes]
+    year_zero = years[0] if len(years) > 0 else 0
 
-    xa_df = xa_df.dropna()
+    days = power["day"].values[day_indexes] + (years - year_zero) * 365
+    minutes = power["minute"].values[minute_indexes]
+    powers = values[year_indexes, day_indexes, minute_indexes]
 
-    year_zero = 0
-    for year, df1 in xa_df.groupby("year"):
-        if year_zero == 0:
-            year_zero = year
-        year_delta = year - year_zero
-        for day, df2 in df1.droplevel("year").groupby("day"):
-            for minute, df3 in df2.droplevel("day").groupby("minute"):
-                days.append(day + year_delta * 365)
-                minutes.append(minute)
-                powers.append(df3["power"].values[0])
     return days, minutes, powers
+
+
+############################
+#   FUNCTIONS FOR CONSTANT TIME DAY ACCESS
+#   A DAY INDEX HOLDS EVERY NON-NAN MEASUREMENT OF AN XARRAY IN FLAT ARRAYS ORDERED BY YEAR, DAY AND MINUTE
+#   DAY d OF YEAR y IS AT flat[starts[key]:ends[key]] WHERE key = (y - first_year) * 366 + d - 1
+#   ARRAYS RETURNED BY get_day AND get_day_range ARE VIEWS, THEY SHOULD NOT BE MODIFIED
+############################
+
+DAYS_PER_YEAR_IN_INDEX = 366
+
+
+def build_day_index(xa):
+    """
+    Builds a day index, values are read from xa once
+    :param xa: xarray with power data variable and year, day, minute coordinates. May contain multiple years
+    :return: day index dict
+    """
+    power = xa["power"].transpose("year", "day", "minute").sortby(["year", "day", "minute"])
+    values = power.values
+
+    year_indexes, day_indexes, minute_indexes = numpy.nonzero(~numpy.isnan(values))
+
+    year_values = power["year"].values
+    first_year = int(year_values.min()) if len(year_values) > 0 else 0
+    year_count = int(year_values.max()) - first_year + 1 if len(year_values) > 0 else 0
+
+    years = year_values[year_indexes]
+    days = power["day"].values[day_indexes]
+
+    # measurements are already ordered by key, counting them gives the start and end of every day
+    keys = (years - first_year) * DAYS_PER_YEAR_IN_INDEX + days - 1
+    counts = numpy.bincount(keys, minlength=year_count * DAYS_PER_YEAR_IN_INDEX)
+    ends = numpy.cumsum(counts)
+
+    return {
+        "first_year": first_year,
+        "years": year_count,
+        "starts": ends - counts,
+        "ends": ends,
+        "year": years,
+        "day": days,
+        "minute": power["minute"].values[minute_indexes],
+        "power": values[year_indexes, day_indexes, minute_indexes]
+    }
+
+
+def get_day(day_index, year, day):
+    """
+    Same values as slice_xa(xa, year, year, day, day).dropna(dim="minute") would give
+    :param day_index: day index from build_day_index
+    :param year: year, eq. 2018
+    :param day: day of year, 1 to 366
+    :return: minutes, powers arrays of the given day, empty if the day has no measurements
+    """
+    start, end = __get_day_bounds(day_index, year, day, year, day)
+
+    return day_index["minute"][start:end], day_index["power"][start:end]
+
+
+def get_day_range(day_index, year_first, day_first, year_last, day_last):
+    """
+    Every measurement from day_first of year_first to day_last of year_last, both included. Unlike slice_xa, the range
+    continues over year boundaries, eq. day 350 of 2017 to day 15 of 2018
+    :param day_index: day index from build_day_index
+    :return: years, days, minutes, powers arrays ordered by year, day and minute
+    """
+    start, end = __get_day_bounds(day_index, year_first, day_first, year_last, day_last)
+
+    return (day_index["year"][start:end], day_index["day"][start:end], day_index["minute"][start:end],
+            day_index["power"][start:end])
+
+
+def get_days_with_measurements(day_index):
+    """
+    :param day_index: day index from build_day_index
+    :return: years, days arrays of every day with at least one measurement
+    """
+    keys = numpy.flatnonzero(day_index["ends"] > day_index["starts"])
+
+    return day_index["first_year"] + keys // DAYS_PER_YEAR_IN_INDEX, keys % DAYS_PER_YEAR_IN_INDEX + 1
+
+
+############################
+#   FUNCTIONS FOR ITERATING DAYS WITHOUT CREATING AN XARRAY PER DAY
+############################
+
+# one day of measurements, minutes and powers are the non-nan values like with dropna(dim="minute"). quality is a dict
+# of the statistics described in day_quality.py
+DayRecord = collections.namedtuple("DayRecord", ["year", "day", "minutes", "powers", "quality"])
+
+
+def iterate_days(xa, year_first, day_first, year_last, day_last, predicate=None, prefetch=False, block_days=None,
+                 days=None):
+    """
+    Generator which yields a DayRecord for every day of xa from day_first of year_first to day_last of year_last. Days
+    are read config.DAY_ITERATOR_BLOCK_DAYS at a time, so lazily loaded xarrays are only computed block by block
+    :param xa: xarray with power data variable and year, day, minute coordinates
+    :param year_first: first year, eq. 2017
+    :param day_first: first day of year_first
+    :param year_last: last year
+    :param day_last: last day of year_last, included
+    :param predicate: optional function which takes a DayRecord and returns True if it should be yielded. Only needed
+    for filters which use the measurements of the day, use days for filtering by day number
+    :param prefetch: if True, the next block is read in a background thread while the current one is processed
+    :param block_days: days read at a time, defaults to config.DAY_ITERATOR_BLOCK_DAYS
+    :param days: optional day numbers, for example from day_quality.select_days. Other days are skipped before
+    reading, so blocks only contain these days
+    :return: generator of DayRecords, ordered by year and day. Days which are not in xa are not yielded
+    """
+    if block_days is None:
+        block_days = config.DAY_ITERATOR_BLOCK_DAYS
+
+    power = xa["power"].transpose("year", "day", "minute").sortby(["year", "day", "minute"])
+    minute_values = power["minute"].values
+
+    blocks = __get_day_blocks(power, year_first, day_first, year_last, day_last, block_days, days)
+
+    if not prefetch:
+        for block in blocks:
+            yield from __day_block_to_records(*__read_day_block(power, block), minute_values, predicate)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        next_block = None
+        for block in blocks:
+            current_block = next_block
+            next_block = executor.submit(__read_day_block, power, block)
+            if current_block is not None:
+                yield from __day_block_to_records(*current_block.result(), minute_values, predicate)
+        if next_block is not None:
+            yield from __day_block_to_records(*next_block.result(), minute_values, predicate)
+
+
+############################
+#   HELPERS BELOW, CALL ONLY FROM WITHIN THIS FILE
+############################
+
+def __get_day_bounds(day_index, year_first, day_first, year_last, day_last):
+    """
+    :return: start and end positions in flat arrays, equal if there are no measurements in range
+    """
+    key_count = len(day_index["starts"])
+    first_key = (int(year_first) - day_index["first_year"]) * DAYS_PER_YEAR_IN_INDEX + int(day_first) - 1
+    last_key = (int(year_last) - day_index["first_year"]) * DAYS_PER_YEAR_IN_INDEX + int(day_last) - 1
+
+    # clamping ranges which extend outside of indexed years
+    first_key = max(first_key, 0)
+    last_key = min(last_key, key_count - 1)
+
+    if first_key > last_key:
+        return 0, 0
+
+    return day_index["starts"][first_key], day_index["ends"][last_key]
+
+
+def __get_day_blocks(power, year_first, day_first, year_last, day_last, block_days, days=None):
+    """
+    :param days: optional day numbers, other days are left out of blocks
+    :return: list of (year index, day indexes) pairs, at most block_days days per pair
+    """
+    year_values = power["year"].values
+    day_values = power["day"].values
+
+    blocks = []
+    for year_index in numpy.flatnonzero((year_values >= year_first) & (year_values <= year_last)):
+        year = year_values[year_index]
+        first = day_first if year == year_first else 1
+        last = day_last if year == year_last else DAYS_PER_YEAR_IN_INDEX
+
+        in_range = (day_values >= first) & (day_values <= last)
+        if days is not None:
+            in_range &= numpy.isin(day_values, numpy.fromiter(days, dtype=numpy.int64))
+
+        day_indexes = numpy.flatnonzero(in_range)
+        for start in range(0, len(day_indexes), block_days):
+            blocks.append((year_index, day_indexes[start:start + block_days]))
+
+    return blocks
+
+
+def __read_day_block(power, block):
+    """
+    :return: year, day numbers and (days, minutes) array of values
+    """
+    year_index, day_indexes = block
+    values = power.isel(year=year_index, day=day_indexes).values
+
+    return power["year"].values[year_index], power["day"].values[day_indexes], values
+
+
+def __day_block_to_records(year, days, values, minute_values, predicate):
+    statistics = day_quality.compute_day_statistics(values, minute_values)
+
+    for i in range(len(days)):
+        valid = ~numpy.isnan(values[i])
+        quality = {name: statistics[name][i] for name in day_quality.QUALITY_VARIABLES}
+        record = DayRecord(year, days[i], minute_values[valid], values[i][valid], quality)
+
+        if predicate is None or predicate(record):
+            yield record